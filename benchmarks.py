@@ -0,0 +1,403 @@
+#! /usr/bin/python3
+"""### Measure the performance of the client scripts.
+
+The source code of this module contains benchmarks for:
+* Request throughput with and without a pooled keep-alive session
+* World loading, heightmap calculation, map rendering and house building
+    against the in-memory emulator of the HTTP interface
+* Formatting block batches with str.format against Interface.placeArray
+* Decoding packed long arrays in pure Python against numpy
+* Fetching the chunks of a WorldSlice in parallel tiles
+* Decoding the chunks of a WorldSlice in worker processes
+* Parsing /chunks payloads with the nbt package against nbtReader
+* Rendering a large area at once against tile by tile with WorldTiles
+
+The session benchmark needs a server on the given host and port,
+    the suite, tile, process and stream benchmarks start their own
+    emulator, the bitarray and nbt benchmarks need neither.
+
+It is not meant to be imported.
+"""
+__all__ = []
+# __version__
+
+import argparse
+import random
+import tracemalloc
+from io import BytesIO
+from time import perf_counter
+
+import nbt
+import numpy as np
+import requests
+
+import houseUtils
+import interfaceUtils
+from bitarray import BitArray, inclusiveBetween, unpackLongs
+from httpEmulator import Emulator, VoxelWorld, packLongs
+from interfaceUtils import (DEFAULT_HOST, DEFAULT_PORT, BlockRegistry,
+                            Interface, formatBlockLines)
+from nbtReader import readChunks
+from worldLoader import WorldSlice, WorldTiles, decodeChunk
+
+
+def timeRequests(function, count):
+    """**Return the requests per second achieved by calling function**."""
+    start = perf_counter()
+    for i in range(count):
+        function(i)
+    return count / (perf_counter() - start)
+
+
+def timed(function, *args, **kwargs):
+    """**Return the duration of a call and its result**."""
+    start = perf_counter()
+    result = function(*args, **kwargs)
+    return perf_counter() - start, result
+
+
+def benchmarkSession(host, port, count):
+    """**Compare bare requests calls against the pooled Interface session**."""
+    url = 'http://{}:{}/blocks?x={}&y=64&z=0'
+    interface = Interface(host=host, port=port)
+
+    results = {
+        "requests.get (new connection)": timeRequests(
+            lambda i: requests.get(url.format(host, port, i % 16)), count),
+        "Interface.getBlock (pooled)": timeRequests(
+            lambda i: interface.getBlock(i % 16, 64, 0), count),
+    }
+    for name, rate in results.items():
+        print("{:<32} {:>10.1f} requests/s".format(name, rate))
+    return results
+
+
+def benchmarkSuite(areaSizes, houseSizes, latency, seed=0):
+    """**Time the main stages of generation against the emulator**."""
+    # these need OpenCV, so they are only imported when the suite runs
+    from mapUtils import calcGoodHeightmap
+    from visualizeMap import renderMap
+
+    results = []
+    with Emulator(VoxelWorld(seed), port=0, latency=latency) as emulator:
+        interfaceUtils.setDefaultConnection(port=emulator.port)
+
+        for size in areaSizes:
+            rect = (0, 0, size, size)
+            loading, worldSlice = timed(WorldSlice, rect)
+            heightmap, _ = timed(calcGoodHeightmap, worldSlice)
+            rendering, _ = timed(renderMap, worldSlice)
+            results += [("load WorldSlice", size, loading),
+                        ("calcGoodHeightmap", size, heightmap),
+                        ("renderMap", size, rendering)]
+
+        interface = Interface(port=emulator.port)
+        houseUtils.setInterface(interface)
+        for size in houseSizes:
+            random.seed(seed)
+            # flatten the building site like gerardus-mercator.py does
+            interface.runCommand("fill 0 64 0 {0} 100 {0} air".format(size))
+            interface.runCommand("fill 0 60 0 {0} 63 {0} dirt".format(size))
+            house = houseUtils.House("benchmark", size, size,
+                                     random.choice(houseUtils.getThemes()))
+            building, _ = timed(house.build, 1, 64, 1)
+            results.append(("House.build", size, building))
+
+        # a 100k block structure of random blocks
+        registry = BlockRegistry()
+        states = [registry.intern(name) for name in
+                  ("stone", "glass", "oak_log[axis=x]", "oak_planks")]
+        volume = np.random.default_rng(seed).choice(states, (50, 40, 50))
+        xs, ys, zs = np.nonzero(volume)
+        ids = volume[xs, ys, zs]
+        formatting, _ = timed(lambda: str.join("\n", [
+            '{} {} {} {}'.format(*bp) for bp in zip(
+                xs.tolist(), ys.tolist(), zs.tolist(),
+                [registry[id] for id in ids.tolist()])]))
+        vectorized, _ = timed(formatBlockLines, xs, ys, zs, ids,
+                              registry.states)
+        placing, _ = timed(interface.placeArray, (0, 100, 0), volume, registry)
+        results += [("str.format body", volume.size, formatting),
+                    ("formatBlockLines", volume.size, vectorized),
+                    ("placeArray", volume.size, placing)]
+
+    print("{:<20} {:>6} {:>10}".format("stage", "size", "seconds"))
+    for stage, size, seconds in results:
+        print("{:<20} {:>6} {:>10.3f}".format(stage, size, seconds))
+    return results
+
+
+def legacyGetAt(longArray, bitsPerEntry, arraySize, index):
+    """**Read an entry the way BitArray.getAt did before numpy**."""
+    inclusiveBetween(0, arraySize - 1, index)
+    entriesPerLong = 64 // bitsPerEntry
+    i = int(index / entriesPerLong)
+    k = (index - i * entriesPerLong) * bitsPerEntry
+    return longArray[i] >> k & (1 << bitsPerEntry) - 1
+
+
+def benchmarkBitArray(repeat, seed=0):
+    """**Compare decoding heightmaps and block states per entry and at once**.
+
+    Every case decodes a whole array: the legacy path calls getAt
+        per entry, the numpy path unpacks the longs in one operation.
+    """
+    rng = np.random.default_rng(seed)
+    cases = [("heightmap", 9, 256)] + [
+        ("block states", bits, 4096) for bits in (4, 5, 6, 8, 13)]
+
+    print("{:<14} {:>4} {:>14} {:>14} {:>14} {:>8}".format(
+        "array", "bits", "legacy us", "getAt us", "unpack us", "speedup"))
+    results = []
+    for name, bits, size in cases:
+        values = rng.integers(0, 1 << bits, size, dtype=np.uint64)
+        longs = [int(long) for long in packLongs(values, bits)]
+        bitArray = BitArray(bits, size, longs)
+
+        legacy, decoded = timed(lambda: [
+            [legacyGetAt(longs, bits, size, i) for i in range(size)]
+            for _ in range(repeat)][-1])
+        scalar, _ = timed(lambda: [
+            [bitArray.getAt(i) for i in range(size)]
+            for _ in range(repeat)])
+        unpack, unpacked = timed(lambda: [
+            unpackLongs(longs, bits, size) for _ in range(repeat)][-1])
+        assert decoded == unpacked.tolist() == values.tolist()
+
+        legacy, scalar, unpack = (seconds / repeat * 1e6
+                                  for seconds in (legacy, scalar, unpack))
+        print("{:<14} {:>4} {:>14.1f} {:>14.1f} {:>14.1f} {:>7.0f}x".format(
+            name, bits, legacy, scalar, unpack, legacy / unpack))
+        results.append((name, bits, legacy, scalar, unpack))
+    return results
+
+
+def benchmarkTiles(size, tilesizes, workers, latency, seed=0):
+    """**Time loading a WorldSlice for every tile size and worker count**.
+
+    Returns the results sorted from the highest throughput.
+    """
+    results = []
+    with Emulator(VoxelWorld(seed), port=0, latency=latency) as emulator:
+        interfaceUtils.setDefaultConnection(port=emulator.port)
+        rect = (0, 0, size, size)
+        chunks = ((size + 15) // 16) ** 2
+
+        single, reference = timed(WorldSlice, rect, heightmapTypes=[],
+                                  dense=True)
+        results.append((None, 1, single))
+        for tilesize in tilesizes:
+            for count in workers:
+                seconds, worldSlice = timed(
+                    WorldSlice, rect, heightmapTypes=[], dense=True,
+                    tilesize=tilesize, workers=count)
+                assert (np.array(worldSlice.palette)[worldSlice.volume]
+                        == np.array(reference.palette)[reference.volume]).all()
+                results.append((tilesize, count, seconds))
+
+    results.sort(key=lambda result: result[2])
+    print("{:>8} {:>8} {:>10} {:>10}".format(
+        "tile", "workers", "seconds", "chunks/s"))
+    for tilesize, count, seconds in results:
+        print("{:>8} {:>8} {:>10.3f} {:>10.1f}".format(
+            "single" if tilesize is None else tilesize, count, seconds,
+            chunks / seconds))
+    tilesize, count, seconds = results[0]
+    print("best: tilesize={} workers={} ({:.1f}x the single request)".format(
+        tilesize, count, single / seconds))
+    return results
+
+
+def benchmarkProcesses(size, processes, tilesize, latency, seed=0):
+    """**Time loading a WorldSlice with a growing number of processes**."""
+    results = []
+    with Emulator(VoxelWorld(seed), port=0, latency=latency) as emulator:
+        interfaceUtils.setDefaultConnection(port=emulator.port)
+        rect = (0, 0, size, size)
+
+        single, reference = timed(WorldSlice, rect, tilesize=tilesize)
+        results.append((None, single))
+        for count in processes:
+            seconds, worldSlice = timed(WorldSlice, rect, tilesize=tilesize,
+                                        workers=count, processes=count)
+            for name, heightmap in reference.heightmaps.items():
+                assert (worldSlice.heightmaps[name] == heightmap).all()
+            results.append((count, seconds))
+
+    print("{:>10} {:>10} {:>8}".format("processes", "seconds", "speedup"))
+    for count, seconds in results:
+        print("{:>10} {:>10.3f} {:>7.2f}x".format(
+            "in-process" if count is None else count, seconds,
+            single / seconds))
+    return results
+
+
+def peakMemory(function, *args):
+    """**Return the peak memory allocated during a call in bytes**."""
+    tracemalloc.start()
+    try:
+        result = function(*args)
+        return tracemalloc.get_traced_memory()[1], result
+    finally:
+        tracemalloc.stop()
+
+
+def benchmarkNbt(sizes, repeat, seed=0):
+    """**Compare parsing /chunks payloads with the nbt package and nbtReader**.
+
+    The payloads are encoded by the emulator, so they only hold the
+        tags WorldSlice reads; server payloads also carry light, biomes
+        and entities, which nbtReader skips without building them.
+    Peak memory is measured while the parsed chunks are kept, as
+        WorldSlice keeps them until they are decoded.
+    """
+    world = VoxelWorld(seed)
+    heightmapTypes = ["MOTION_BLOCKING", "MOTION_BLOCKING_NO_LEAVES",
+                      "OCEAN_FLOOR", "WORLD_SURFACE"]
+
+    def parseTree(payload):
+        return nbt.nbt.NBTFile(buffer=BytesIO(payload))
+
+    def parseRecords(payload):
+        return list(readChunks(memoryview(payload)))
+
+    print("{:>6} {:>10} {:>12} {:>12} {:>12} {:>10} {:>10}".format(
+        "size", "MB", "nbt ms", "reader ms", "decode ms", "nbt MB",
+        "reader MB"))
+    results = []
+    for size in sizes:
+        chunks = (size + 15) // 16
+        payload = world.encodeChunks(0, 0, chunks, chunks)
+        tree, _ = timed(lambda: [parseTree(payload) for _ in range(repeat)])
+        reader, records = timed(lambda: [
+            parseRecords(payload) for _ in range(repeat)][-1])
+        decode, _ = timed(lambda: [[decodeChunk(chunk, heightmapTypes)
+                                    for chunk in records]
+                                   for _ in range(repeat)])
+        treeMemory, _ = peakMemory(parseTree, payload)
+        readerMemory, _ = peakMemory(parseRecords, payload)
+
+        tree, reader, decode = (seconds / repeat * 1e3
+                                for seconds in (tree, reader, decode))
+        print("{:>6} {:>10.1f} {:>12.1f} {:>12.1f} {:>12.1f} {:>10.1f} "
+              "{:>10.1f}".format(size, len(payload) / 1e6, tree, reader,
+                                 decode, treeMemory / 1e6, readerMemory / 1e6))
+        results.append((size, len(payload), tree, reader, decode,
+                        treeMemory, readerMemory))
+    return results
+
+
+def benchmarkStream(size, tilesizes, overlap, seed=0):
+    """**Compare rendering an area in one WorldSlice and in WorldTiles**.
+
+    Reports the time and the peak memory traced while loading and
+        rendering, and checks that the images are identical.
+    """
+    # these need OpenCV, so they are only imported when the benchmark runs
+    from visualizeMap import renderMap, renderTiles
+
+    results = []
+    with Emulator(VoxelWorld(seed), port=0) as emulator:
+        interfaceUtils.setDefaultConnection(port=emulator.port)
+        rect = (0, 0, size, size)
+
+        def renderWhole():
+            return renderMap(WorldSlice(rect, heightmapTypes=[
+                "MOTION_BLOCKING_NO_LEAVES", "OCEAN_FLOOR"], cache=False))
+
+        def renderTiled(tilesize):
+            with WorldTiles(rect, tilesize, overlap, cache=False,
+                            heightmapTypes=["MOTION_BLOCKING_NO_LEAVES",
+                                            "OCEAN_FLOOR"]) as tiles:
+                return renderTiles(tiles)
+
+        seconds, (memory, (reference, _)) = timed(peakMemory, renderWhole)
+        results.append((None, seconds, memory))
+        for tilesize in tilesizes:
+            seconds, (memory, (image, _)) = timed(peakMemory, renderTiled,
+                                                  tilesize)
+            assert overlap < 1 or (image == reference).all()
+            results.append((tilesize, seconds, memory))
+
+    print("{:>8} {:>10} {:>10}".format("tile", "seconds", "peak MB"))
+    for tilesize, seconds, memory in results:
+        print("{:>8} {:>10.3f} {:>10.1f}".format(
+            "whole" if tilesize is None else tilesize, seconds, memory / 1e6))
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    session = subparsers.add_parser("session", help="pooled vs new sessions")
+    session.add_argument("--host", default=DEFAULT_HOST)
+    session.add_argument("--port", type=int, default=DEFAULT_PORT)
+    session.add_argument("--count", type=int, default=1000)
+
+    suite = subparsers.add_parser("suite", help="end-to-end with emulator")
+    suite.add_argument("--areas", type=int, nargs="+", default=[64, 128, 256])
+    suite.add_argument("--houses", type=int, nargs="+", default=[9, 13, 17])
+    suite.add_argument("--latency", type=float, default=0.0,
+                       help="seconds the emulator adds to every request")
+    suite.add_argument("--seed", type=int, default=0)
+
+    bitArray = subparsers.add_parser("bitarray", help="BitArray decoding")
+    bitArray.add_argument("--repeat", type=int, default=20)
+    bitArray.add_argument("--seed", type=int, default=0)
+
+    tiles = subparsers.add_parser("tiles", help="parallel chunk fetching")
+    tiles.add_argument("--size", type=int, default=256,
+                       help="side length of the area in blocks")
+    tiles.add_argument("--tilesizes", type=int, nargs="+",
+                       default=[2, 4, 8, 16], help="tile sides in chunks")
+    tiles.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    tiles.add_argument("--latency", type=float, default=0.05,
+                       help="seconds the emulator adds to every request")
+    tiles.add_argument("--seed", type=int, default=0)
+
+    processes = subparsers.add_parser("processes",
+                                      help="chunk decoding in processes")
+    processes.add_argument("--size", type=int, default=256,
+                           help="side length of the area in blocks")
+    processes.add_argument("--processes", type=int, nargs="+",
+                           default=[1, 2, 4, 8, 16])
+    processes.add_argument("--tilesize", type=int, default=4,
+                           help="tile side in chunks")
+    processes.add_argument("--latency", type=float, default=0.0,
+                           help="seconds the emulator adds to every request")
+    processes.add_argument("--seed", type=int, default=0)
+
+    nbtParser = subparsers.add_parser("nbt", help="chunk payload parsing")
+    nbtParser.add_argument("--sizes", type=int, nargs="+",
+                           default=[128, 256, 512],
+                           help="side lengths of the areas in blocks")
+    nbtParser.add_argument("--repeat", type=int, default=3)
+    nbtParser.add_argument("--seed", type=int, default=0)
+
+    stream = subparsers.add_parser("stream", help="tile by tile rendering")
+    stream.add_argument("--size", type=int, default=512,
+                        help="side length of the area in blocks")
+    stream.add_argument("--tilesizes", type=int, nargs="+", default=[4, 8],
+                        help="tile sides in chunks")
+    stream.add_argument("--overlap", type=int, default=1,
+                        help="blocks each tile overlaps its neighbours")
+    stream.add_argument("--seed", type=int, default=0)
+
+    args = parser.parse_args()
+    if args.benchmark == "session":
+        benchmarkSession(args.host, args.port, args.count)
+    elif args.benchmark == "suite":
+        benchmarkSuite(args.areas, args.houses, args.latency, args.seed)
+    elif args.benchmark == "bitarray":
+        benchmarkBitArray(args.repeat, args.seed)
+    elif args.benchmark == "tiles":
+        benchmarkTiles(args.size, args.tilesizes, args.workers, args.latency,
+                       args.seed)
+    elif args.benchmark == "processes":
+        benchmarkProcesses(args.size, args.processes, args.tilesize,
+                           args.latency, args.seed)
+    elif args.benchmark == "nbt":
+        benchmarkNbt(args.sizes, args.repeat, args.seed)
+    elif args.benchmark == "stream":
+        benchmarkStream(args.size, args.tilesizes, args.overlap, args.seed)
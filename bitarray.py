@@ -1,11 +1,13 @@
 #! /usr/bin/python3
 """### Read the bitarray format used by Minecraft.
 """
-__all__ = ['BitArray']
+__all__ = ['BitArray', 'unpackLongs']
 # __version__
 
 from math import floor
 
+import numpy as np
+
 
 def inclusiveBetween(start, end, value):
     if value < start or value > end:
@@ -13,35 +15,57 @@ def inclusiveBetween(start, end, value):
             "The value {} is not in the inclusive range of {} to {}".format(value, start, end))
 
 
+def unpackLongs(longs, bitsPerEntry, arraySize):
+    """**Unpack a whole array of packed longs with numpy**.
+
+    Entries do not span two longs, and the longs may be signed,
+        as they are read from NBT.
+    Returns a uint16 array (uint32 above 16 bits per entry).
+    """
+    longs = np.asarray(longs, dtype=np.int64).view(np.uint64)
+    entriesPerLong = 64 // bitsPerEntry
+    shifts = np.arange(entriesPerLong, dtype=np.uint64) \
+        * np.uint64(bitsPerEntry)
+    mask = np.uint64((1 << bitsPerEntry) - 1)
+    values = (longs[:, np.newaxis] >> shifts) & mask
+    dtype = np.uint16 if bitsPerEntry <= 16 else np.uint32
+    return values.reshape(-1)[:arraySize].astype(dtype)
+
+
 # Minecraft stores block and heightmap data in compacted arrays of longs. This class does the proper index mapping and bit shifting to get to the actual data.
 
 class BitArray:
-    def __init__(self, bitsPerEntryIn, arraySizeIn, data):
+    def __init__(self, bitsPerEntryIn, arraySizeIn, data, values=None):
         inclusiveBetween(1, 32, bitsPerEntryIn)
         self.arraySize = arraySizeIn
         self.bitsPerEntry = bitsPerEntryIn
         self.maxEntryValue = (1 << bitsPerEntryIn) - 1
         self.entriesPerLong = floor(64 / bitsPerEntryIn)
         j = floor((arraySizeIn + self.entriesPerLong - 1) / self.entriesPerLong)
-        if (data != None):
+        if values is not None:
+            # already decoded, e.g. by another process
+            self.longArray = []
+            self.array = values
+        elif data is not None:
             if (len(data) != j):
                 raise Exception(
                     "Invalid length given for storage, got: {} but expected: {}".format(len(data), j))
 
             self.longArray = data
+            # NBT long arrays keep their values in a list
+            self.array = unpackLongs(getattr(data, "value", data),
+                                     bitsPerEntryIn, arraySizeIn)
         else:
             self.longArray = []  # length j
+            self.array = np.zeros(0, dtype=np.uint16)
 
     def getPosOfLong(self, index):
-        return int(index / self.entriesPerLong)
+        return index // self.entriesPerLong
 
     def getAt(self, index):
-        inclusiveBetween(0, (self.arraySize - 1), index)
-        i = self.getPosOfLong(index)
-        # print("{} > {}".format(index, i))
-        j = self.longArray[i]
-        k = (index - i * self.entriesPerLong) * self.bitsPerEntry
-        return (j >> k & self.maxEntryValue)
+        if not 0 <= index < self.arraySize:
+            inclusiveBetween(0, (self.arraySize - 1), index)
+        return int(self.array[index])
 
     def size(self):
         return self.arraySize
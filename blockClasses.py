@@ -0,0 +1,80 @@
+#! /usr/bin/python3
+"""### Classify blocks once per palette entry instead of once per block.
+
+This module contains:
+* The named block classes used by the analyses (log, leaves, liquid,
+    transparent, ignorable, solid)
+* A predicate index that turns a palette into boolean lookup tables
+
+A table is indexed by palette index, so `table[ids]` classifies a whole
+    array of blocks at once (see WorldSlice.classTable and find).
+Add a predicate on namespaced block names to CLASSES to define a class.
+"""
+__all__ = ['IGNORABLES', 'LIQUIDS', 'CLASSES', 'PredicateIndex']
+# __version__
+
+import numpy as np
+
+import blockColors
+
+IGNORABLES = ("minecraft:air",
+              "minecraft:oak_leaves", "minecraft:dark_oak_leaves",
+              "minecraft:spruce_leaves", "minecraft:birch_leaves",
+              "minecraft:acacia_leaves", "minecraft:jungle_leaves",
+              )
+LIQUIDS = ("minecraft:water", "minecraft:lava")
+
+TRANSPARENT = frozenset(blockColors.TRANSPARENT)
+
+
+def isTransparent(name):
+    return name in TRANSPARENT
+
+
+def isLiquid(name):
+    return name in LIQUIDS
+
+
+def isSolid(name):
+    # everything that is not ignorable, liquid or transparent; leaves are
+    #   also matched by suffix, like the leaves class
+    return not (name in IGNORABLES or name in LIQUIDS
+                or name in TRANSPARENT or name[-7:] == "_leaves")
+
+
+CLASSES = {
+    "log": lambda name: name[-4:] == "_log",
+    "leaves": lambda name: name[-7:] == "_leaves",
+    "liquid": isLiquid,
+    # blocks the map shows the block below of
+    "transparent": isTransparent,
+    # blocks houses may be built through
+    "ignorable": lambda name: name in IGNORABLES,
+    # blocks that are none of the above
+    "solid": isSolid,
+}
+
+
+class PredicateIndex:
+    """**Boolean lookup tables of block classes over a palette**.
+
+    The palette is a list of block names that may grow, like the one of
+        a WorldSlice; tables are extended to new entries when used.
+    """
+
+    def __init__(self, palette, classes=CLASSES):
+        self.palette = palette
+        self.classes = classes
+        self.tables = {}
+
+    def table(self, className):
+        """**Return the table of a class, True where an entry belongs**."""
+        predicate = self.classes[className]
+        table = self.tables.get(className)
+        if table is None:
+            table = np.zeros(0, dtype=bool)
+        if len(table) < len(self.palette):
+            table = self.tables[className] = np.append(table, np.array(
+                [predicate(name) for name in self.palette[len(table):]],
+                dtype=bool))
+        return table
@@ -0,0 +1,203 @@
+#! /usr/bin/python3
+"""### Keep decoded chunks on disk between runs.
+
+This module contains tools to:
+* Store the heightmaps and sections of chunks as numpy files
+* Load them memory-mapped into a WorldSlice instead of requesting them
+* Invalidate them explicitly, by age or when the Interface changes them
+
+Chunks are stored per world under a directory. The world is identified
+    by the server address unless a name is given, so use `world` when
+    switching maps on the same server.
+Set GDMC_CHUNK_CACHE to a directory to cache the chunks of every
+    WorldSlice without changing a script.
+Commands are only seen if they are fill, setblock or clone commands with
+    absolute coordinates, use `invalidate` after others.
+"""
+__all__ = ['ChunkCache', 'enable', 'disable']
+# __version__
+
+import json
+import os
+import re
+from time import time
+
+import numpy as np
+
+import interfaceUtils
+import worldLoader  # imported as a module, worldLoader may import this one
+from bitarray import BitArray
+
+
+class ChunkCache():
+    """**Stores decoded chunks as memory-mapped numpy files**.
+
+    Every chunk is kept as three files: the block states of its sections,
+        its heightmaps and a JSON file with the palettes, which is written
+        last and marks the chunk as complete.
+    Chunks older than `maxage` seconds are fetched again.
+    """
+
+    def __init__(self, directory, world=None, maxage=None):
+        self.directory = directory
+        self.world = world
+        self.maxage = maxage
+        self.absent = set()  # (directory, cx, cz) known to have no files
+        self.directories = {}  # world directories by server address
+        self.hits = 0
+        self.misses = 0
+
+    def worldDirectory(self, interface=None):
+        """**Return the directory of the world served to an interface**."""
+        url = (interfaceUtils if interface is None else interface).url
+        directory = self.directories.get(url)
+        if directory is None:
+            world = url if self.world is None else self.world
+            directory = self.directories[url] = os.path.join(
+                self.directory, re.sub(r"[^A-Za-z0-9_.-]+", "_", world))
+        return directory
+
+    def paths(self, directory, cx, cz):
+        """**Return the state, heightmap and palette files of a chunk**."""
+        base = os.path.join(directory, "{}.{}".format(cx, cz))
+        return base + ".states.npy", base + ".heightmaps.npy", base + ".json"
+
+    def load(self, chunkRect, heightmapTypes, interface=None):
+        """**Return (heightmaps, sections) of all chunks in chunkRect**.
+
+        Missing and outdated chunks are fetched with a single request
+            for their bounding rect and stored first.
+        The block states are memory-mapped, not copied.
+        """
+        directory = self.worldDirectory(interface)
+        x, z, dx, dz = chunkRect
+        chunks = [None] * (dx * dz)
+        missing = []
+        for index in range(dx * dz):
+            cx, cz = x + index % dx, z + index // dx
+            chunks[index] = self.read(directory, cx, cz, heightmapTypes)
+            if chunks[index] is None:
+                missing.append((cx, cz))
+        self.misses += len(missing)
+        self.hits += dx * dz - len(missing)
+        if not missing:
+            return chunks
+
+        self.fetch(directory, missing, interface)
+        for cx, cz in missing:
+            chunks[cx - x + (cz - z) * dx] = self.read(
+                directory, cx, cz, heightmapTypes, checkAge=False)
+        return chunks
+
+    def read(self, directory, cx, cz, heightmapTypes, checkAge=True):
+        """**Load a chunk or return None if it is not usable**."""
+        statesPath, heightmapsPath, metaPath = self.paths(directory, cx, cz)
+        try:
+            with open(metaPath) as file:
+                meta = json.load(file)
+        except FileNotFoundError:
+            return None
+        if checkAge and self.maxage is not None \
+                and time() - meta["time"] > self.maxage:
+            return None
+        if any(hmName not in meta["heightmapTypes"]
+               for hmName in heightmapTypes):
+            return None
+
+        stored = np.load(heightmapsPath, mmap_mode="r")
+        heightmaps = {hmName: stored[meta["heightmapTypes"].index(hmName)]
+                      for hmName in heightmapTypes}
+        states = np.load(statesPath, mmap_mode="r")
+        sections = [(y, palette, BitArray(bits, 16 * 16 * 16, None,
+                                          values=states[index]))
+                    for index, (y, bits, palette)
+                    in enumerate(meta["sections"])]
+        return heightmaps, sections
+
+    def fetch(self, directory, chunks, interface=None):
+        """**Request chunks from the server and store them**."""
+        xs = [cx for cx, cz in chunks]
+        zs = [cz for cx, cz in chunks]
+        x, z = min(xs), min(zs)
+        dx, dz = max(xs) - x + 1, max(zs) - z + 1
+        records = worldLoader.readChunkRecords(x, z, dx, dz, interface)
+
+        os.makedirs(directory, exist_ok=True)
+        for index, chunk in enumerate(records):
+            heightmapTypes = list(chunk['Heightmaps'].keys())
+            heightmaps, sections = worldLoader.decodeChunk(chunk,
+                                                           heightmapTypes)
+            self.store(directory, x + index % dx, z + index // dx,
+                       heightmapTypes, heightmaps, sections)
+
+    def store(self, directory, cx, cz, heightmapTypes, heightmaps, sections):
+        """**Write the decoded heightmaps and sections of a chunk**."""
+        statesPath, heightmapsPath, metaPath = self.paths(directory, cx, cz)
+        states = np.zeros((len(sections), 16 * 16 * 16), dtype=np.uint16)
+        meta = {"time": time(), "heightmapTypes": heightmapTypes,
+                "sections": []}
+        for index, (y, palette, bitArray) in enumerate(sections):
+            states[index] = bitArray.array
+            meta["sections"].append((y, bitArray.bitsPerEntry, palette))
+
+        for path, array in ((statesPath, states), (heightmapsPath, np.array(
+                [heightmaps[hmName] for hmName in heightmapTypes],
+                dtype=np.uint16).reshape(-1, 16, 16))):
+            with open(path + ".tmp", "wb") as file:
+                np.save(file, array)
+            os.replace(path + ".tmp", path)
+        with open(metaPath + ".tmp", "w") as file:
+            json.dump(meta, file, separators=(",", ":"))
+        os.replace(metaPath + ".tmp", metaPath)
+        self.absent.discard((directory, cx, cz))
+
+    def invalidate(self, box=None, interface=None):
+        """**Forget the chunks touched by an inclusive box, or all of them**.
+
+        The box is in global block coordinates, like BlockCache.invalidate.
+        """
+        directory = self.worldDirectory(interface)
+        if box is None:
+            if os.path.isdir(directory):
+                for name in os.listdir(directory):
+                    os.remove(os.path.join(directory, name))
+            self.absent = set()
+            return
+        for cx in range(box[0] >> 4, (box[3] >> 4) + 1):
+            for cz in range(box[2] >> 4, (box[5] >> 4) + 1):
+                if (directory, cx, cz) in self.absent:
+                    continue
+                # the palette file goes first, so the chunk is never complete
+                for path in reversed(self.paths(directory, cx, cz)):
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+                self.absent.add((directory, cx, cz))
+
+    def stats(self):
+        """**Return the hit and miss counters in chunks**."""
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses,
+                "hitrate": self.hits / total if total else 0.0}
+
+
+def enable(directory, world=None, maxage=None):
+    """**Cache the chunks of every WorldSlice under directory**.
+
+    Blocks placed through any Interface invalidate their chunks.
+    """
+    interfaceUtils.chunkCache = ChunkCache(directory, world, maxage)
+    return interfaceUtils.chunkCache
+
+
+def disable():
+    """**Stop caching chunks**."""
+    interfaceUtils.chunkCache = None
+
+
+if os.environ.get("GDMC_CHUNK_CACHE"):
+    maxage = os.environ.get("GDMC_CHUNK_CACHE_MAXAGE")
+    enable(os.environ["GDMC_CHUNK_CACHE"],
+           os.environ.get("GDMC_CHUNK_CACHE_WORLD"),
+           float(maxage) if maxage else None)
@@ -18,9 +18,11 @@ __credits__ = "Nils Gawlick for being awesome and creating the framework" + \
 
 import random
 
+import numpy as np
+
 import interfaceUtils
 import mapUtils
-from interfaceUtils import Interface
+from interfaceUtils import BlockCache, Interface
 from worldLoader import WorldSlice
 
 # set up an interface for getting and placing blocks
@@ -31,12 +33,30 @@ interface = Interface()
 #       >>> interface.toggleBuffer()
 #   Change maximum buffer size (default is 4096 blocks)
 #       >>> interface.bufferlimit = 100
+#   Or let the batch size follow the server latency
+#       >>> interface.controller = interfaceUtils.BatchController()
+#       >>> interface.controller.operatingPoint()
 #   Send blocks to world
 #       >>> interface.sendBlocks()
 #   NOTE: The buffer will automatically place its blocks once it gets full
 #   NOTE: It is a good idea to call sendBlocks() after completing a task,
 #       so that you can see the result without having to wait
 #   IMPORTANT: A crash may prevent the blocks from being placed
+# How to send full buffers from a background thread:
+#   Create the interface in background-flush mode
+#       >>> interface = Interface(backgroundflush=True)
+#   Wait until all pending blocks are placed
+#       >>> failed = interface.flush()
+#   NOTE: flush() returns the batches that could not be sent
+#   NOTE: Use interface.close() or a with statement when you are done
+# How to keep uploading batches while the next ones are generated:
+#   Replace the interface with a bridge to an asyncio interface
+#       >>> from interfaceUtils import AsyncInterface, SyncBridge
+#       >>> interface = SyncBridge(AsyncInterface(maxinflight=4))
+#   Wait for all uploads to be acknowledged
+#       >>> interface.drain()
+#   NOTE: houseUtils only uses this interface (and its cache)
+#       after houseUtils.setInterface(interface)
 
 # x position, z position, x size, z size
 area = (0, 0, 128, 128)  # default build area
@@ -73,12 +93,13 @@ def buildHouse(x1, y1, z1, x2, y2, z2):
     interface.fill(x2 - 1, y1, z2 - 1, x2 - 1, y2, z2 - 1, "oak_log")
 
     # clear interior
-    for y in range(y1 + 1, y2):
-        for x in range(x1 + 1, x2 - 1):
-            for z in range(z1 + 1, z2 - 1):
-                # check what's at that place and only delete if not air
-                if "air" not in interface.getBlock(x, y, z):
-                    interface.setBlock(x, y, z, "air")
+    # read the whole interior at once (uses the /chunks endpoint)
+    blocks, palette = interface.getBlocks(x1 + 1, y1 + 1, z1 + 1,
+                                          x2 - 2, y2 - 1, z2 - 2)
+    for (dx, dy, dz), index in np.ndenumerate(blocks):
+        # check what's at that place and only delete if not air
+        if "air" not in palette[index]:
+            interface.setBlock(x1 + 1 + dx, y1 + 1 + dy, z1 + 1 + dz, "air")
 
     # roof
     if x2 - x1 < z2 - z1:   # if the house is longer in Z-direction
@@ -110,7 +131,12 @@ if __name__ == '__main__':
 
     # load the world data
     # this uses the /chunks endpoint in the background
-    worldSlice = WorldSlice(area)
+    # chunks changed through the interface can be re-loaded with refresh()
+    worldSlice = WorldSlice(area, interface=interface)
+
+    # answer getBlock from the loaded world data instead of the server
+    # blocks placed through the interface are remembered as well
+    interface.cache = BlockCache(worldSlice)
 
     # caclulate a heightmap suitable for building:
     heightmap = mapUtils.calcGoodHeightmap(worldSlice)
@@ -186,3 +212,9 @@ if __name__ == '__main__':
             buildHouse(houseX, houseY, houseZ, houseX + houseSizeX,
                        houseY + houseSizeY, houseZ + houseSizeZ)
             houses.append(houseRect)
+
+            # re-load only the chunks the house changed
+            worldSlice.refresh(interface)
+            heightmap = mapUtils.calcGoodHeightmap(worldSlice)
+
+    print("block cache: {}".format(interface.cache.stats()))
@@ -6,6 +6,7 @@ import houseUtils
 import interfaceUtils
 import mapUtils
 from houseUtils import House
+from interfaceUtils import BlockCache
 from worldLoader import WorldSlice
 
 # x position, z position, x size, z size
@@ -29,11 +30,13 @@ print("Build area is at position %s, %s with size %s, %s" % area)
 
 # load the world data
 # this uses the /chunks endpoint in the background
-worldSlice = WorldSlice(area)
-heightmap = worldSlice.heightmaps["MOTION_BLOCKING"]
-heightmap = worldSlice.heightmaps["MOTION_BLOCKING_NO_LEAVES"]
-heightmap = worldSlice.heightmaps["OCEAN_FLOOR"]
-heightmap = worldSlice.heightmaps["WORLD_SURFACE"]
+# heightmaps and sections are only decoded when they are used
+worldSlice = WorldSlice(area, lazy=True)
+# available heightmaps:
+# >>> heightmap = worldSlice.heightmaps["MOTION_BLOCKING"]
+# >>> heightmap = worldSlice.heightmaps["MOTION_BLOCKING_NO_LEAVES"]
+# >>> heightmap = worldSlice.heightmaps["OCEAN_FLOOR"]
+# >>> heightmap = worldSlice.heightmaps["WORLD_SURFACE"]
 # caclulate a heightmap that ignores trees:
 heightmap = mapUtils.calcGoodHeightmap(worldSlice)
 
@@ -55,20 +58,32 @@ def heightAt(x, z):
 
 THEMES = houseUtils.getThemes()
 
+# the interface used by houseUtils remembers which chunks it changed
+interface = houseUtils.interface
+# answer the getBlock calls of houseUtils from the loaded world data
+interface.cache = BlockCache(worldSlice)
+
 counter = 0
 while True:
     randx, randz = [random.randint(5, 21), random.randint(5, 21)]
-    interfaceUtils.runCommand("fill 9 65 9 33 100 33 air")
-    interfaceUtils.runCommand("kill @e[type=item]")
-    interfaceUtils.runCommand("fill 9 64 9 33 64 33 dirt")
-    interfaceUtils.runCommand("fill 9 63 9 33 63 33 dirt")
-    interfaceUtils.runCommand("fill 9 62 9 33 60 33 stone")
+    interface.runCommand("fill 9 65 9 33 100 33 air")
+    interface.runCommand("kill @e[type=item]")
+    interface.runCommand("fill 9 64 9 33 64 33 dirt")
+    interface.runCommand("fill 9 63 9 33 63 33 dirt")
+    interface.runCommand("fill 9 62 9 33 60 33 stone")
     print("House #{}: {}x{}".format(counter, randx, randz))
-    interfaceUtils.runCommand(
+    interface.runCommand(
         "fill 10 64 10 {} 64 {} minecraft:water".format(9 + randx, 9 + randz))
+    # re-load the chunks the commands changed, so the block cache
+    # reads them from the slice again
+    worldSlice.refresh(interface)
     newHouse = House("House #" + str(counter),
                      randz, randx, random.choice(THEMES)
                      )
     newHouse.build(10, 64, 10)
+    # re-load only the chunks that changed
+    worldSlice.refresh(interface)
+    heightmap = mapUtils.calcGoodHeightmap(worldSlice)
+    print("block cache: {}".format(interface.cache.stats()))
     input("Done!")
     counter += 1
@@ -16,8 +16,8 @@ from copy import copy
 from random import choice as choice
 from time import sleep as sleep
 
-from interfaceUtils import getBlock
-from interfaceUtils import setBlock as sB
+from blockClasses import IGNORABLES, LIQUIDS
+from interfaceUtils import BuildPlan, Interface
 
 UNITSIZE = 4
 UNITHEIGHT = 4
@@ -26,12 +26,6 @@ MAXHEIGHT = 1
 DEFAULT_POOL = (1, 2)
 ORTHFACTORS = ((1, 0), (-1, 0), (0, 1), (0, -1))
 DESIGNATIONS = ("sky", "roofing", "masonry")  # corresponding index
-IGNORABLES = ("minecraft:air",
-              "minecraft:oak_leaves", "minecraft:sark_oak_leaves",
-              "minecraft:spruce_leaves", "minecraft:birch_leaves",
-              "minecraft:acacia_leaves", "minecraft:jungle_leaves",
-              )
-LIQUIDS = ("minecraft:water", "minecraft:lava")
 TRANSPARENT = ("glass", "fence", "trapdoor")
 WETNESSON = True
 UNWETTABLE = {"birch_log", "birch_wood"}
@@ -39,6 +33,25 @@ WETBLOCKS = {"birch": "oak", "oak": "spruce", "spruce": "dark_oak",
              "cobblestone": "mossy_cobblestone",
              "stone_bricks": "mossy_stone_bricks"}
 
+# all block access goes through this interface (see setInterface)
+interface = Interface()
+
+
+def setInterface(newInterface):
+    """Use a different interface (e.g. a SyncBridge) for block access."""
+    global interface
+    interface = newInterface
+
+
+def getBlock(x, y, z):
+    """Return the block at a defined location."""
+    return interface.getBlock(x, y, z)
+
+
+def sB(x, y, z, block):
+    """Place a single block and return the server response."""
+    return interface.placeBlock(x, y, z, block)
+
 
 def setBlock(x, y, z, block, a="y", f="north", requirepunch=False):
     """Place a block at a defined location."""
@@ -61,10 +74,17 @@ def setBlock(x, y, z, block, a="y", f="north", requirepunch=False):
                   "[axis={axis}]", "[waterlogged=" + waterlogged + "]",
                   "", "_planks"]
 
+    candidates = [(block + addon).format(axis=a, facing=f)
+                  for addon in fullblocks]
+    if isinstance(interface, BuildPlan):
+        # the plan tries the other candidates when it is executed
+        interface.placeBlock(x, y, z, candidates[0], candidates[1:])
+        return
+
     response = " "
-    for addon in fullblocks:
+    for candidate in candidates:
         if not response.isnumeric():
-            response = sB(x, y, z, (block + addon).format(axis=a, facing=f))
+            response = sB(x, y, z, candidate)
         else:
             return
     if not response.isnumeric():
@@ -0,0 +1,590 @@
+#! /usr/bin/python3
+"""### Emulate the GDMC HTTP interface with an in-memory world.
+
+This module contains tools to:
+* Generate a simple deterministic voxel world
+* Serve the /blocks, /chunks, /command and /buildarea endpoints
+* Add artificial latency to every request
+* Refuse unknown block ids and block states like the interface mod
+
+It allows running and measuring the client scripts without Minecraft:
+    >>> python3 httpEmulator.py --port 9000 --latency 0.005
+"""
+__all__ = ['VoxelWorld', 'Emulator']
+# __version__
+
+import argparse
+import json
+import re
+import struct
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from math import ceil, log2
+from time import sleep
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+
+import blockColors
+
+HEIGHTMAP_TYPES = ("MOTION_BLOCKING", "MOTION_BLOCKING_NO_LEAVES",
+                   "OCEAN_FLOOR", "WORLD_SURFACE")
+FILL_LIMIT = 32768
+AIRS = ("minecraft:air", "minecraft:cave_air", "minecraft:void_air")
+
+AXIS = ("axis",)
+PANE = ("east", "north", "south", "west", "waterlogged")
+CAMPFIRE = ("facing", "lit", "signal_fire", "waterlogged")
+# block state names of the 1.16 blocks that have any, by id or (starting
+#   with "_") by the end of the id; longer endings are matched first
+BLOCK_STATES = {
+    "basalt": AXIS, "polished_basalt": AXIS, "quartz_pillar": AXIS,
+    "purpur_pillar": AXIS, "hay_block": AXIS, "bone_block": AXIS,
+    "chain": ("axis", "waterlogged"),
+    "water": ("level",), "lava": ("level",),
+    "grass_block": ("snowy",), "podzol": ("snowy",), "mycelium": ("snowy",),
+    "torch": (), "soul_torch": (), "redstone_torch": ("lit",),
+    "wall_torch": ("facing",), "soul_wall_torch": ("facing",),
+    "redstone_wall_torch": ("facing", "lit"), "redstone_lamp": ("lit",),
+    "lantern": ("hanging",), "soul_lantern": ("hanging",),
+    "ladder": ("facing", "waterlogged"),
+    "glass_pane": PANE, "iron_bars": PANE,
+    "campfire": CAMPFIRE, "soul_campfire": CAMPFIRE,
+    "furnace": ("facing", "lit"), "smoker": ("facing", "lit"),
+    "blast_furnace": ("facing", "lit"),
+    "chest": ("facing", "type", "waterlogged"),
+    "trapped_chest": ("facing", "type", "waterlogged"),
+    "barrel": ("facing", "open"),
+    "lectern": ("facing", "has_book", "powered"),
+    "bell": ("attachment", "facing", "powered"),
+    "anvil": ("facing",), "chipped_anvil": ("facing",),
+    "damaged_anvil": ("facing",),
+    "_log": AXIS, "_wood": AXIS, "_stem": AXIS, "_hyphae": AXIS,
+    "_stairs": ("facing", "half", "shape", "waterlogged"),
+    "_slab": ("type", "waterlogged"),
+    "_fence": PANE,
+    "_fence_gate": ("facing", "in_wall", "open", "powered"),
+    "_wall": ("east", "north", "south", "up", "west", "waterlogged"),
+    "_door": ("facing", "half", "hinge", "open", "powered"),
+    "_trapdoor": ("facing", "half", "open", "powered", "waterlogged"),
+    "_leaves": ("distance", "persistent"),
+    "_pane": PANE,
+    "_button": ("face", "facing", "powered"),
+    "_sign": ("rotation", "waterlogged"),
+    "_wall_sign": ("facing", "waterlogged"),
+    "_bed": ("facing", "occupied", "part"),
+    "_banner": ("rotation",), "_wall_banner": ("facing",),
+    "_glazed_terracotta": ("facing",),
+}
+BLOCK_ENDINGS = sorted((key for key in BLOCK_STATES if key[0] == "_"),
+                       key=len, reverse=True)
+# the block ids without block states
+BLOCKS = frozenset(blockColors.TRANSPARENT).union(
+    *blockColors.PALETTE.values())
+
+BOOLEAN = ("true", "false")
+# values of the block states that are checked
+STATE_VALUES = {
+    "axis": ("x", "y", "z"), "facing": ("north", "east", "south", "west",
+                                        "up", "down"),
+    "half": ("top", "bottom", "upper", "lower"),
+    "type": ("top", "bottom", "double", "single", "left", "right"),
+    "hinge": ("left", "right"), "face": ("floor", "wall", "ceiling"),
+    "waterlogged": BOOLEAN, "open": BOOLEAN, "powered": BOOLEAN,
+    "in_wall": BOOLEAN, "persistent": BOOLEAN, "hanging": BOOLEAN,
+    "lit": BOOLEAN, "snowy": BOOLEAN,
+}
+BLOCK_PATTERN = re.compile(r"\s*([a-z0-9_.:-]+)\s*(?:\[([^\]]*)\])?(.*)",
+                           re.DOTALL)
+
+
+def normalizeBlock(block):
+    """**Return the namespaced block id without block states**."""
+    name = block.split("[", 1)[0].strip()
+    if ":" not in name:
+        name = "minecraft:" + name
+    return name
+
+
+def blockProperties(name):
+    """**Return the block state names of a namespaced id, None if unknown**."""
+    path = name.split(":", 1)[1]
+    properties = BLOCK_STATES.get(path)
+    if properties is not None:
+        return properties
+    for ending in BLOCK_ENDINGS:
+        if path.endswith(ending):
+            return BLOCK_STATES[ending]
+    return () if name in BLOCKS else None
+
+
+def parseBlock(block, properties=blockProperties):
+    """**Return the namespaced id of a block string the server accepts**.
+
+    `properties` returns the block state names of an id, None if the id
+        is unknown. Raises ValueError with the error text of the mod.
+    """
+    match = BLOCK_PATTERN.fullmatch(block)
+    if match is None:
+        raise ValueError("Invalid block: {}".format(block))
+    path, states, rest = match.groups()
+    name = path if ":" in path else "minecraft:" + path
+    if rest.strip():
+        raise ValueError("Expected whitespace to end one argument, "
+                         "but found trailing data")
+    known = properties(name)
+    if known is None:
+        raise ValueError("Unknown block type '{}'".format(name))
+    seen = set()
+    for state in (states or "").split(","):
+        if not state.strip():
+            continue
+        key, _, value = (part.strip() for part in state.partition("="))
+        if key not in known:
+            raise ValueError("Block {} does not have property '{}'".format(
+                name, key))
+        if key in seen:
+            raise ValueError("Property '{}' can only be set once for "
+                             "block {}".format(key, name))
+        if not value or value not in STATE_VALUES.get(key, (value,)):
+            raise ValueError("Block {} does not accept '{}' for {} "
+                             "property".format(name, value, key))
+        seen.add(key)
+    return name
+
+
+def packLongs(values, bitsPerEntry):
+    """**Pack values into signed longs like Minecraft's BitArray**.
+
+    Entries do not span two longs.
+    """
+    entriesPerLong = 64 // bitsPerEntry
+    count = ceil(len(values) / entriesPerLong)
+    padded = np.zeros(count * entriesPerLong, dtype=np.uint64)
+    padded[:len(values)] = values
+    shifts = np.arange(entriesPerLong, dtype=np.uint64) \
+        * np.uint64(bitsPerEntry)
+    longs = np.bitwise_or.reduce(
+        padded.reshape(count, entriesPerLong) << shifts, axis=1)
+    return longs.view(np.int64)
+
+
+class VoxelWorld():
+    """**Stores a world as one (y, z, x) uint16 array per chunk**.
+
+    Chunks are generated on first access, all arrays index one palette.
+    Placed blocks are checked with parseBlock, using `blocks` (a mapping
+        of namespaced ids to their block state names) if given.
+    """
+
+    def __init__(self, seed=0, sealevel=62, blocks=None):
+        self.seed = seed
+        self.sealevel = sealevel
+        self.blocks = blocks
+        self.palette = []
+        self.indices = {}
+        self.chunks = {}
+        self.lock = threading.RLock()
+        for block in AIRS:
+            self.index(block)
+
+    def index(self, block):
+        """**Return the palette index of a block, adding it if needed**."""
+        name = normalizeBlock(block)
+        index = self.indices.get(name)
+        if index is None:
+            index = self.indices[name] = len(self.palette)
+            self.palette.append(name)
+        return index
+
+    def parse(self, block):
+        """**Return the namespaced id of a block string, see parseBlock**."""
+        if self.blocks is None:
+            return parseBlock(block)
+        return parseBlock(block, self.blocks.get)
+
+    def chunk(self, cx, cz):
+        """**Return the block array of a chunk, generating it if needed**."""
+        with self.lock:
+            blocks = self.chunks.get((cx, cz))
+            if blocks is None:
+                blocks = self.chunks[(cx, cz)] = self.generate(cx, cz)
+            return blocks
+
+    def generate(self, cx, cz):
+        """**Generate hilly terrain with lakes and a few trees**."""
+        xs = cx * 16 + np.arange(16)
+        zs = cz * 16 + np.arange(16)
+        # ground height indexed [z, x]
+        height = (self.sealevel + 1
+                  + 4 * np.sin((xs[None, :] + self.seed) / 9.0)
+                  + 3 * np.cos((zs[:, None] - self.seed) / 7.0)).astype(int)
+        ys = np.arange(256)[:, None, None]
+
+        blocks = np.zeros((256, 16, 16), dtype=np.uint16)
+        blocks[ys[:, :, :] < height - 3] = self.index("stone")
+        blocks[(ys >= height - 3) & (ys < height - 1)] = self.index("dirt")
+        top = np.where(height > self.sealevel, self.index("grass_block"),
+                       self.index("sand"))
+        surface = ys == height - 1
+        blocks[surface] = np.broadcast_to(top, (256, 16, 16))[surface]
+        blocks[(ys >= height) & (ys < self.sealevel)] = self.index("water")
+        blocks[0] = self.index("bedrock")
+
+        for z in range(16):
+            for x in range(16):
+                wx, wz = xs[x], zs[z]
+                h = height[z, x]
+                if (wx * 7 + wz * 13 + self.seed) % 97 == 0 \
+                        and h > self.sealevel and 2 <= x < 14 and 2 <= z < 14:
+                    blocks[h + 3:h + 6, z - 2:z + 3, x - 2:x + 3] = \
+                        self.index("oak_leaves")
+                    blocks[h:h + 5, z, x] = self.index("oak_log")
+        return blocks
+
+    def getBlock(self, x, y, z):
+        """**Return the block name at a position**."""
+        if not 0 <= y < 256:
+            return "minecraft:void_air"
+        return self.palette[self.chunk(x >> 4, z >> 4)[y, z & 15, x & 15]]
+
+    def setBlock(self, x, y, z, block):
+        """**Place a block and return whether it changed anything**.
+
+        Raises ValueError for block strings the server would refuse.
+        """
+        index = self.index(self.parse(block))
+        if not 0 <= y < 256:
+            return False
+        with self.lock:
+            blocks = self.chunk(x >> 4, z >> 4)
+            if blocks[y, z & 15, x & 15] == index:
+                return False
+            blocks[y, z & 15, x & 15] = index
+            return True
+
+    def fill(self, x1, y1, z1, x2, y2, z2, block, mode="replace",
+             replacing=None):
+        """**Fill an inclusive box and return the number of changed blocks**.
+
+        Supports the destroy, hollow, keep, outline and replace modes.
+        Raises ValueError for block strings the server would refuse.
+        """
+        xlo, xhi = sorted((x1, x2))
+        ylo, yhi = sorted((max(0, y1), min(255, y2)))
+        zlo, zhi = sorted((z1, z2))
+        index = self.index(self.parse(block))
+        air = self.indices["minecraft:air"]
+        filterIndex = None if replacing is None \
+            else self.index(self.parse(replacing))
+        changed = 0
+        with self.lock:
+            for cx in range(xlo >> 4, (xhi >> 4) + 1):
+                for cz in range(zlo >> 4, (zhi >> 4) + 1):
+                    blocks = self.chunk(cx, cz)
+                    bx, ex = max(xlo, cx * 16), min(xhi, cx * 16 + 15)
+                    bz, ez = max(zlo, cz * 16), min(zhi, cz * 16 + 15)
+                    region = blocks[ylo:yhi + 1, bz & 15:(ez & 15) + 1,
+                                    bx & 15:(ex & 15) + 1]
+                    y, z, x = np.meshgrid(np.arange(ylo, yhi + 1),
+                                          np.arange(bz, ez + 1),
+                                          np.arange(bx, ex + 1),
+                                          indexing="ij")
+                    shell = (x == xlo) | (x == xhi) | (y == ylo) \
+                        | (y == yhi) | (z == zlo) | (z == zhi)
+                    target = np.full(region.shape, index, dtype=np.uint16)
+                    if mode == "hollow":
+                        target[~shell] = air
+                        mask = np.ones(region.shape, dtype=bool)
+                    elif mode == "outline":
+                        mask = shell
+                    elif mode == "keep":
+                        mask = region == air
+                    elif filterIndex is not None:
+                        mask = region == filterIndex
+                    else:
+                        mask = np.ones(region.shape, dtype=bool)
+                    mask &= region != target
+                    region[mask] = target[mask]
+                    changed += int(mask.sum())
+        return changed
+
+    def heightmaps(self, cx, cz):
+        """**Return the four heightmaps of a chunk as (z, x) arrays**."""
+        blocks = self.chunk(cx, cz)
+        # classify each palette entry once, then look the blocks up
+        names = np.array(self.palette)
+        isAir = np.isin(names, AIRS)
+        isLiquid = np.isin(names, ("minecraft:water", "minecraft:lava"))
+        isLeaves = np.char.endswith(names, "_leaves")
+        isPlant = np.char.endswith(names, "_sapling") \
+            | np.isin(names, ("minecraft:grass", "minecraft:tall_grass",
+                              "minecraft:fern", "minecraft:poppy",
+                              "minecraft:dandelion"))
+        tables = {"WORLD_SURFACE": ~isAir,
+                  "MOTION_BLOCKING": ~isAir & ~isPlant,
+                  "MOTION_BLOCKING_NO_LEAVES": ~isAir & ~isPlant & ~isLeaves,
+                  "OCEAN_FLOOR": ~isAir & ~isPlant & ~isLiquid}
+        masks = {name: table[blocks] for name, table in tables.items()}
+        result = {}
+        for name, mask in masks.items():
+            # index of the highest matching block plus one, 0 if none
+            top = 256 - np.argmax(mask[::-1], axis=0)
+            top[~mask.any(axis=0)] = 0
+            result[name] = top
+        return result
+
+    def encodeChunks(self, x, z, dx, dz):
+        """**Return the NBT bytes served by /chunks for a chunk rect**."""
+        with self.lock:
+            chunks = [self.encodeChunk(cx, cz)
+                      for cz in range(z, z + dz) for cx in range(x, x + dx)]
+        return tagHeader(10, "") + tagHeader(9, "Chunks") \
+            + struct.pack(">bi", 10, len(chunks)) + b"".join(chunks) \
+            + b"\x00"
+
+    def encodeChunk(self, cx, cz):
+        """**Return the payload of a single chunk compound**."""
+        blocks = self.chunk(cx, cz)
+        heightmaps = b""
+        for name, heightmap in self.heightmaps(cx, cz).items():
+            heightmaps += tagLongArray(name, packLongs(heightmap.ravel(), 9))
+
+        sections = []
+        for y in range(16):
+            section = blocks[y * 16:(y + 1) * 16]
+            palette, states = np.unique(section, return_inverse=True)
+            if len(palette) == 1 and self.palette[palette[0]] in AIRS:
+                continue
+            bitsPerEntry = max(4, ceil(log2(len(palette))))
+            paletteTags = b"".join(
+                tagHeader(8, "Name") + tagString(self.palette[index])
+                + b"\x00" for index in palette)
+            sections.append(
+                tagHeader(1, "Y") + struct.pack(">b", y)
+                + tagHeader(9, "Palette")
+                + struct.pack(">bi", 10, len(palette)) + paletteTags
+                + tagLongArray("BlockStates",
+                               packLongs(states.ravel(), bitsPerEntry))
+                + b"\x00")
+
+        level = tagHeader(3, "xPos") + struct.pack(">i", cx) \
+            + tagHeader(3, "zPos") + struct.pack(">i", cz) \
+            + tagHeader(10, "Heightmaps") + heightmaps + b"\x00" \
+            + tagHeader(9, "Sections") \
+            + struct.pack(">bi", 10, len(sections)) + b"".join(sections)
+        return tagHeader(10, "Level") + level + b"\x00" + b"\x00"
+
+
+def tagString(value):
+    """**Encode an NBT string payload**."""
+    encoded = value.encode("utf-8")
+    return struct.pack(">H", len(encoded)) + encoded
+
+
+def tagHeader(tagType, name):
+    """**Encode the type and name of a named NBT tag**."""
+    return struct.pack(">b", tagType) + tagString(name)
+
+
+def tagLongArray(name, longs):
+    """**Encode a named NBT long array**."""
+    return tagHeader(12, name) + struct.pack(">i", len(longs)) \
+        + longs.astype(">i8").tobytes()
+
+
+def parseCoordinate(token, origin):
+    """**Parse an absolute or ~relative command coordinate**."""
+    if token.startswith("~"):
+        return origin + (int(token[1:]) if len(token) > 1 else 0)
+    return int(token)
+
+
+class Emulator():
+    """**Serves a VoxelWorld over HTTP like the GDMC interface mod**.
+
+    Every request waits `latency` seconds before it is answered.
+    Use as a context manager or call start() and stop().
+    """
+
+    def __init__(self, world=None, host="localhost", port=9000,
+                 latency=0.0, buildArea=None):
+        self.world = VoxelWorld() if world is None else world
+        self.latency = latency
+        self.buildArea = buildArea  # (x1, y1, z1, x2, y2, z2) or None
+        self.server = ThreadingHTTPServer((host, port), EmulatorHandler)
+        self.server.daemon_threads = True
+        self.server.emulator = self
+        self.thread = None
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    def start(self):
+        """**Serve requests from a background thread**."""
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """**Stop serving and close the socket**."""
+        self.server.shutdown()
+        self.server.server_close()
+        if self.thread is not None:
+            self.thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    # ----------------------------------------------------- endpoints
+
+    def getBlocks(self, query):
+        return self.world.getBlock(int(query["x"]), int(query["y"]),
+                                   int(query["z"]))
+
+    def putBlocks(self, query, body):
+        x, y, z = (int(query.get(key, 0)) for key in "xyz")
+        lines = body.strip().split("\n")
+        if len(lines) == 1 and not re.match(r"^~?-?\d+ ", lines[0]):
+            return self.placeBlock(x, y, z, lines[0])
+        results = []
+        for line in lines:
+            if not line.strip():
+                continue
+            bx, by, bz, block = line.strip().split(" ", 3)
+            results.append(self.placeBlock(parseCoordinate(bx, x),
+                                           parseCoordinate(by, y),
+                                           parseCoordinate(bz, z), block))
+        return "\n".join(results)
+
+    def placeBlock(self, x, y, z, block):
+        """**Place a block and return its response line**."""
+        try:
+            return "1" if self.world.setBlock(x, y, z, block) else "0"
+        except ValueError as e:
+            return str(e)
+
+    def getChunks(self, query):
+        return self.world.encodeChunks(int(query["x"]), int(query["z"]),
+                                       int(query.get("dx", 1)),
+                                       int(query.get("dz", 1)))
+
+    def postCommand(self, body):
+        return "\n".join(self.runCommand(line)
+                         for line in body.strip().split("\n"))
+
+    def runCommand(self, command):
+        """**Run a single command, only fill and setblock change blocks**."""
+        # block states may contain spaces
+        tokens = re.findall(r"[^\s\[]*\[[^\]]*\]\S*|\S+",
+                            command.strip().lstrip("/"))
+        try:
+            if tokens[0] == "fill":
+                box = [int(token) for token in tokens[1:7]]
+                volume = (abs(box[3] - box[0]) + 1) \
+                    * (abs(box[4] - box[1]) + 1) * (abs(box[5] - box[2]) + 1)
+                if volume > FILL_LIMIT:
+                    return "Too many blocks in the specified area " \
+                        "(maximum {}, specified {})".format(FILL_LIMIT, volume)
+                mode = tokens[8] if len(tokens) > 8 else "replace"
+                replacing = tokens[9] if len(tokens) > 9 else None
+                changed = self.world.fill(*box, tokens[7], mode, replacing)
+                if changed == 0:
+                    return "No blocks were filled"
+                return "Successfully filled {} blocks".format(changed)
+            elif tokens[0] == "setblock":
+                x, y, z = (int(token) for token in tokens[1:4])
+                if self.world.setBlock(x, y, z, tokens[4]):
+                    return "Changed the block at {}, {}, {}".format(x, y, z)
+                return "Could not set the block"
+        except (IndexError, ValueError) as e:
+            return "Invalid command: {}".format(e)
+        return "Unsupported command: {}".format(tokens[0])
+
+    def getBuildArea(self):
+        if self.buildArea is None:
+            return -1
+        keys = ("xFrom", "yFrom", "zFrom", "xTo", "yTo", "zTo")
+        return dict(zip(keys, self.buildArea))
+
+
+class EmulatorHandler(BaseHTTPRequestHandler):
+    """**Dispatches HTTP requests to the Emulator**."""
+
+    protocol_version = "HTTP/1.1"
+    wbufsize = -1  # send headers and body together
+
+    def do_GET(self):
+        self.dispatch("GET")
+
+    def do_PUT(self):
+        self.dispatch("PUT")
+
+    def do_POST(self):
+        self.dispatch("POST")
+
+    def dispatch(self, method):
+        emulator = self.server.emulator
+        parts = urlsplit(self.path)
+        query = {key: values[0] for key, values
+                 in parse_qs(parts.query).items()}
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length).decode("utf-8") if length else ""
+        if emulator.latency > 0:
+            sleep(emulator.latency)
+
+        contentType = "text/plain"
+        status = 200
+        if parts.path == "/blocks" and method == "GET":
+            result = emulator.getBlocks(query)
+        elif parts.path == "/blocks" and method == "PUT":
+            result = emulator.putBlocks(query, body)
+        elif parts.path == "/chunks" and method == "GET":
+            result = emulator.getChunks(query)
+            contentType = "application/octet-stream"
+        elif parts.path == "/command" and method == "POST":
+            result = emulator.postCommand(body)
+        elif parts.path == "/buildarea" and method == "GET":
+            result = json.dumps(emulator.getBuildArea())
+            contentType = "application/json"
+        else:
+            status = 404
+            result = "Unknown endpoint: {} {}".format(method, parts.path)
+
+        if isinstance(result, str):
+            result = result.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", contentType)
+        self.send_header("Content-Length", str(len(result)))
+        self.end_headers()
+        self.wfile.write(result)
+        self.wfile.flush()
+
+    def log_message(self, format, *args):
+        pass
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="seconds added to every request")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--buildarea", type=int, nargs=6,
+                        metavar=("X1", "Y1", "Z1", "X2", "Y2", "Z2"))
+    args = parser.parse_args()
+
+    emulator = Emulator(VoxelWorld(args.seed), args.host, args.port,
+                        args.latency, args.buildarea)
+    print("Emulating the HTTP interface on http://{}:{}".format(
+        args.host, emulator.port))
+    try:
+        emulator.server.serve_forever()
+    except KeyboardInterrupt:
+        emulator.server.server_close()
@@ -7,38 +7,285 @@ This module contains functions to:
 * Get the name of a block at a particular coordinate
 * Place blocks in the world
 """
-__all__ = ['requestBuildArea', 'runCommand',
+__all__ = ['Interface', 'requestBuildArea', 'runCommand',
            'setBlock', 'getBlock',
-           'placeBlockBatched', 'sendBlocks']
+           'placeBlockBatched', 'sendBlocks',
+           'createSession', 'setDefaultConnection', 'httpRequest',
+           'AsyncInterface', 'SyncBridge',
+           'FILL_LIMIT', 'FILL_MODES', 'BlockCache', 'BatchController',
+           'KEEP', 'BlockRegistry', 'blockStates', 'formatBlockLines',
+           'BuildPlan', 'markWritten', 'commandBox']
 __author__ = "Nils Gawlik <nilsgawlik@gmx.de>"
 __date__ = "11 March 2021"
 # __version__
 __credits__ = "Nils Gawlick for being awesome and creating the framework" + \
     "Flashing Blinkenlights for general improvements"
 
+import asyncio
+import atexit
+import os
+import queue
+import random
+import threading
 import warnings
+import weakref
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from time import perf_counter, sleep
+from urllib.parse import urlsplit
 
+import numpy as np
 import requests
+from requests.adapters import HTTPAdapter
+
+import metricsUtils
+
+DEFAULT_HOST = "localhost"
+DEFAULT_PORT = 9000
+DEFAULT_POOLSIZE = 10
+
+
+def createSession(poolsize=DEFAULT_POOLSIZE):
+    """**Return a keep-alive session with a connection pool**.
+
+    Reusing the session avoids opening a new TCP connection per request.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=poolsize, pool_maxsize=poolsize)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def setDefaultConnection(host=DEFAULT_HOST, port=DEFAULT_PORT,
+                         poolsize=DEFAULT_POOLSIZE):
+    """**Point the module-level functions at a different server**."""
+    global session, url
+    session.close()
+    session = createSession(poolsize)
+    url = 'http://{}:{}'.format(host, port)
+
+
+# shared by runCommand, the deprecated functions and worldLoader
+session = createSession()
+url = 'http://{}:{}'.format(DEFAULT_HOST, DEFAULT_PORT)
+
+
+# set by trafficUtils to record or replay all requests
+recorder = None
+replayer = None
+
+# set by chunkCache to keep the chunks of every WorldSlice on disk
+chunkCache = None
+
+
+def markWritten(box, interface=None):
+    """**Invalidate the cached chunks touched by an inclusive global box**.
+
+    Call this once the server has applied the change, so chunks loaded
+        in between are not kept.
+    """
+    if chunkCache is not None:
+        chunkCache.invalidate(box, interface)
+
+
+def chunkBoxes(blocks, x=0, z=0):
+    """**Return the column boxes of the chunks holding some blocks**.
+
+    The blocks are (x, y, z, block) tuples, offset by x and z.
+    """
+    chunks = {((bx + x) >> 4, (bz + z) >> 4) for bx, by, bz, block in blocks}
+    return [(cx * 16, 0, cz * 16, cx * 16 + 15, 255, cz * 16 + 15)
+            for cx, cz in chunks]
+
+
+def closeAtExit(instance):
+    """**Close an instance at exit without keeping it alive**.
+
+    Returns the hook, to be passed to atexit.unregister once closed.
+    """
+    reference = weakref.ref(instance)
+
+    def hook():
+        instance = reference()
+        if instance is not None:
+            instance.close()
+    atexit.register(hook)
+    return hook
+
+
+def httpRequest(session, method, url, data=None, headers=None, blocks=0):
+    """**Send a request through a session and record its metrics**.
+
+    Every call to the HTTP interface goes through this function.
+    `blocks` is the number of blocks placed by the request.
+    """
+    endpoint = method + " " + urlsplit(url).path
+    if data is None:
+        requestBytes = 0
+    elif isinstance(data, str):
+        requestBytes = len(data.encode("utf-8"))
+    else:
+        requestBytes = len(data)
+    start = perf_counter()
+    try:
+        if replayer is not None:
+            response = replayer.request(method, url, data)
+        else:
+            response = session.request(method, url, data=data,
+                                       headers=headers)
+    except Exception:
+        metricsUtils.registry.record(endpoint, perf_counter() - start,
+                                     requestBytes, failed=True)
+        raise
+    duration = perf_counter() - start
+    metricsUtils.registry.record(endpoint, duration,
+                                 requestBytes, len(response.content),
+                                 blocks, not response.ok)
+    if recorder is not None:
+        recorder.record(method, url, data, response, start, duration)
+    return response
+
+
+def backoffDelay(attempt, base=0.1, cap=10.0):
+    """**Return an exponential backoff delay with full jitter**."""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class BatchController():
+    """**Adapts batch size and concurrency to the server latency**.
+
+    Every batch reports its size, latency and response size.
+    The batch size is set so a batch takes about `targetlatency` seconds,
+        based on the smoothed time per block.
+    The number of concurrent batches grows by one while batches are fast
+        and is halved when they are too slow (additive increase,
+        multiplicative decrease).
+    """
+
+    def __init__(self, targetlatency=0.25, batchsize=1024,
+                 minbatch=64, maxbatch=16384, inflight=1, maxinflight=4,
+                 smoothing=0.3, backoffbase=0.1, backoffcap=10.0):
+        self.targetlatency = targetlatency
+        self.batchsize = batchsize
+        self.minbatch = minbatch
+        self.maxbatch = maxbatch
+        self.inflight = inflight
+        self.maxinflight = maxinflight
+        self.smoothing = smoothing
+        self.backoffbase = backoffbase
+        self.backoffcap = backoffcap
+
+        self.lock = threading.Lock()
+        self.latency = None  # smoothed seconds per batch
+        self.blocktime = None  # smoothed seconds per block
+        self.responsebytes = None  # smoothed response bytes per block
+        self.batches = 0
+        self.failures = 0
+
+    def smooth(self, old, new):
+        """**Return the exponentially weighted moving average**."""
+        if old is None:
+            return new
+        return old + self.smoothing * (new - old)
+
+    def record(self, blocks, latency, responsebytes):
+        """**Adjust the operating point after a successful batch**."""
+        if blocks == 0:
+            return
+        with self.lock:
+            self.batches += 1
+            self.latency = self.smooth(self.latency, latency)
+            self.blocktime = self.smooth(self.blocktime, latency / blocks)
+            self.responsebytes = self.smooth(self.responsebytes,
+                                             responsebytes / blocks)
+
+            batchsize = int(self.targetlatency / max(self.blocktime, 1e-9))
+            self.batchsize = max(self.minbatch, min(self.maxbatch, batchsize))
+
+            if self.latency > 1.5 * self.targetlatency:
+                self.inflight = max(1, self.inflight // 2)
+            elif self.latency < self.targetlatency:
+                self.inflight = min(self.maxinflight, self.inflight + 1)
+
+    def backoff(self, attempt):
+        """**Count a failure and return how long to wait before retrying**."""
+        with self.lock:
+            self.failures += 1
+            self.inflight = max(1, self.inflight // 2)
+        return backoffDelay(attempt, self.backoffbase, self.backoffcap)
+
+    def operatingPoint(self):
+        """**Return the current settings and measurements**."""
+        return {"batchsize": self.batchsize, "inflight": self.inflight,
+                "latency": self.latency, "blocktime": self.blocktime,
+                "responsebytes": self.responsebytes,
+                "batches": self.batches, "failures": self.failures}
 
 
 class Interface():
     """**Provides tools for interacting with the HTML interface**.
 
     All function parameters and returns are in local coordinates.
+    Every request goes through a pooled keep-alive session.
+
+    With `backgroundflush` a full buffer is swapped with an empty one
+        and sent by a worker thread, so the caller does not wait for
+        the server. At most `queuesize` full buffers wait to be sent;
+        once the queue is full the caller blocks until the worker catches up.
+    Use `flush()` to wait for all pending blocks, and `close()`
+        (or a with statement) when done. Sending more blocks after
+        `close()` starts the workers again. Both return the batches that
+        could not be sent, since their blocks are no longer buffered.
+
+    An optional BlockCache answers getBlock locally where possible.
+
+    An optional BatchController replaces `bufferlimit` with an adaptive
+        batch size; in background mode it also decides how many batches
+        are sent at the same time (which may complete out of order).
     """
 
-    def __init__(self, offset=(0, 0, 0), buffering=False, bufferlimit=4096):
+    def __init__(self, offset=(0, 0, 0), buffering=False, bufferlimit=4096,
+                 host=DEFAULT_HOST, port=DEFAULT_PORT,
+                 poolsize=DEFAULT_POOLSIZE,
+                 backgroundflush=False, queuesize=2, cache=None,
+                 controller=None):
         self.offset = offset
-        self.__buffering = False
-        self.bufferlimit = 4096
+        self.__buffering = buffering
+        self.bufferlimit = bufferlimit
         self.buffer = []
+        self.url = 'http://{}:{}'.format(host, port)
+        self.session = createSession(poolsize)
+
+        self.backgroundflush = backgroundflush
+        self.queue = queue.Queue(maxsize=queuesize)
+        self.workers = []
+        self.active = 0  # batches currently being sent by the workers
+        self.failed = []  # queued (function, args) that could not be sent
+        self.slots = threading.Condition()
+        self.closed = False
+        self._exitHook = None  # closes the workers at exit (see closeAtExit)
+
+        self.cache = cache
+        self.controller = controller
+        # chunks changed since the last WorldSlice.refresh
+        self.dirty = set()
+        # candidate lists of BuildPlans and the candidate the server accepted
+        self.accepted = {}
 
     def __del__(self):
-        self.sendBlocks()
+        self.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
 
     def requestBuildArea(self):
         """**Return the building area**."""
-        response = requests.get('http://localhost:9000/buildarea')
+        response = httpRequest(self.session, "GET", self.url + '/buildarea')
         if response.ok:
             buildArea = response.json()
             if buildArea != -1:
@@ -57,28 +304,135 @@ class Interface():
         """**Return the name of a block in the world**."""
         x, y, z = self.local2global(x, y, z)
 
-        url = 'http://localhost:9000/blocks?x={}&y={}&z={}'.format(x, y, z)
+        if self.cache is not None:
+            block = self.cache.get(x, y, z)
+            if block is not None:
+                return block
+        block = self._requestBlock(x, y, z)
+        if self.cache is not None and block != "minecraft:void_air":
+            self.cache.put(x, y, z, block)
+        return block
+
+    def getBlocks(self, x1, y1, z1, x2, y2, z2):
+        """**Return all blocks in a box with a single /chunks request**.
+
+        Returns a numpy array of palette indices, indexed [x, y, z]
+            relative to the lowest corner, and the list of block names.
+        Blocks outside the world height are air.
+        """
+        from worldLoader import WorldSlice  # worldLoader imports this module
+
+        self.sendPending()
+        x1, y1, z1 = self.local2global(x1, y1, z1)
+        x2, y2, z2 = self.local2global(x2, y2, z2)
+        xlo, ylo, zlo = min(x1, x2), min(y1, y2), min(z1, z2)
+        xhi, yhi, zhi = max(x1, x2), max(y1, y2), max(z1, z2)
+
+        worldSlice = WorldSlice((xlo, zlo, xhi - xlo + 1, zhi - zlo + 1),
+                                heightmapTypes=[], interface=self)
+        volume, palette = worldSlice.buildVolume()
+        blocks = np.zeros((xhi - xlo + 1, yhi - ylo + 1, zhi - zlo + 1),
+                          dtype=np.uint16)
+        by, ey = max(ylo, 0), min(yhi, 255)
+        if by <= ey:
+            blocks[:, by - ylo:ey - ylo + 1] = volume[:, by:ey + 1]
+        return blocks, palette
+
+    def _requestBlock(self, x, y, z):
+        """**Ask the server for a block in global coordinates**."""
+        url = self.url + '/blocks?x={}&y={}&z={}'.format(x, y, z)
         try:
-            response = requests.get(url)
+            response = httpRequest(self.session, "GET", url)
         except ConnectionError:
             return "minecraft:void_air"
         return response.text
 
-    def fill(self, x1, y1, z1, x2, y2, z2, str):
+    def runCommand(self, command):
+        """**Run a Minecraft command in the world**.
+
+        Buffered blocks are sent first, so the command sees them.
+        """
+        self.sendPending()
+        try:
+            response = httpRequest(self.session, "POST",
+                                   self.url + '/command',
+                                   bytes(command, "utf-8"))
+        except ConnectionError:
+            return "connection error"
+        box = commandBox(command)
+        if box is not None:
+            self.markDirty(box)
+            if self.cache is not None:
+                self.cache.invalidate(box)
+        return response.text
+
+    def fill(self, x1, y1, z1, x2, y2, z2, str, mode="replace",
+             replacing=None):
+        """**Fill a box with blocks using server-side fill commands**.
+
+        `mode` is one of FILL_MODES, `replacing` optionally restricts
+            the "replace" mode to a particular block.
+        Boxes larger than FILL_LIMIT are split into multiple commands.
+        Blocks are only placed individually if a command fails.
+        """
+        if mode not in FILL_MODES:
+            raise ValueError("Unknown fill mode: {}".format(mode))
         x1, y1, z1 = self.local2global(x1, y1, z1)
         x2, y2, z2 = self.local2global(x2, y2, z2)
-        xlo, ylo, zlo = min(x1, x2), min(y1, y2), min(z1, z2)
-        xhi, yhi, zhi = max(x1, x2), max(y1, y2), max(z1, z2)
+        box = (min(x1, x2), min(y1, y2), min(z1, z2),
+               max(x1, x2), max(y1, y2), max(z1, z2))
 
+        if mode in ("hollow", "outline") and boxVolume(box) > FILL_LIMIT:
+            # splitting would create walls inside the box, so fill the shell
+            #   and the interior separately instead
+            parts = [(shell, str, "replace") for shell in boxShell(box)]
+            interior = boxInterior(box)
+            if mode == "hollow" and interior is not None:
+                parts.append((interior, "air", "replace"))
+        else:
+            parts = [(box, str, mode)]
+
+        for part, block, partmode in parts:
+            for piece in splitBox(part):
+                command = "fill {} {} {} {} {} {} {}".format(*piece, block)
+                if partmode != "replace" or replacing is not None:
+                    command += " " + partmode
+                if partmode == "replace" and replacing is not None:
+                    command += " " + replacing
+                response = self.runCommand(command)
+                if self.cache is not None:
+                    self.cache.invalidate(piece)
+                if not fillSucceeded(response):
+                    print("fill command failed: {}".format(response))
+                    self._fillBlocks(piece, block, partmode, replacing)
+
+    def _fillBlocks(self, box, str, mode="replace", replacing=None):
+        """**Fill a box (in global coordinates) block by block**."""
+        xlo, ylo, zlo = self.global2local(*box[:3])
+        xhi, yhi, zhi = self.global2local(*box[3:])
         for x in range(xlo, xhi + 1):
             for y in range(ylo, yhi + 1):
                 for z in range(zlo, zhi + 1):
+                    onShell = x in (xlo, xhi) or y in (ylo, yhi) \
+                        or z in (zlo, zhi)
+                    if mode == "outline" and not onShell:
+                        continue
+                    if mode == "hollow" and not onShell:
+                        self.setBlock(x, y, z, "air")
+                        continue
+                    if mode == "keep" \
+                            and "air" not in self.getBlock(x, y, z):
+                        continue
+                    if mode == "replace" and replacing is not None \
+                            and blockName(self.getBlock(x, y, z)) \
+                            != blockName(replacing):
+                        continue
                     self.setBlock(x, y, z, str)
 
     def setBlock(self, x, y, z, str):
         """**Place a block in the world depending on buffer activation**."""
         if self.__buffering:
-            self.placeBlockBatched(x, y, z, str, self.bufferlimit)
+            self.placeBlockBatched(x, y, z, str, self.batchLimit())
         else:
             self.placeBlock(x, y, z, str)
 
@@ -86,11 +440,15 @@ class Interface():
         """**Place a single block in the world**."""
         x, y, z = self.local2global(x, y, z)
 
-        url = 'http://localhost:9000/blocks?x={}&y={}&z={}'.format(x, y, z)
+        url = self.url + '/blocks?x={}&y={}&z={}'.format(x, y, z)
         try:
-            response = requests.put(url, str)
+            response = httpRequest(self.session, "PUT", url, str, blocks=1)
         except ConnectionError:
             return "0"
+        if response.text.isnumeric():
+            if self.cache is not None:
+                self.cache.write(x, y, z, str)
+            self.markDirty((x, y, z, x, y, z))
         return response.text
 
     # ----------------------------------------------------- block buffers
@@ -110,7 +468,7 @@ class Interface():
         if self.__buffering:
             print("Buffering has been activated.")
         else:
-            self.sendBlocks()
+            self.sendPending()
             print("Buffering has been deactivated.")
 
     def placeBlockBatched(self, x, y, z, str, limit=50):
@@ -118,6 +476,8 @@ class Interface():
         x, y, z = self.local2global(x, y, z)
 
         self.buffer.append((x, y, z, str))
+        if self.cache is not None:
+            self.cache.write(x, y, z, str)
         if len(self.buffer) >= limit:
             return self.sendBlocks()
         else:
@@ -128,18 +488,216 @@ class Interface():
 
         Since the buffer contains global coordinates
             no conversion takes place in this function
+        In background mode the buffer is only queued and None is returned.
         """
-        url = 'http://localhost:9000/blocks?x={}&y={}&z={}'.format(x, y, z)
-        body = str.join("\n", ['{} {} {} {}'.format(*bp)
-                               for bp in self.buffer])
-        try:
-            response = requests.put(url, body)
+        if len(self.buffer) == 0:
+            return None
+        if self.backgroundflush:
+            blocks, self.buffer = self.buffer, []
+            self._startWorker()
+            self.queue.put((self._sendBatch, (blocks, x, y, z, retries)))
+            return None
+        response = self._sendBatch(self.buffer, x, y, z, retries)
+        if response is not None:
             self.buffer = []
-            return response.text
-        except ConnectionError as e:
-            print("Request failed: {} Retrying ({} left)".format(e, retries))
-            if retries > 0:
-                return self.sendBlocks(x, y, z, retries - 1)
+        return response
+
+    def _sendBatch(self, blocks, x=0, y=0, z=0, retries=5):
+        """**Send a list of blocks to the server**."""
+        body = str.join("\n", ['{} {} {} {}'.format(*bp) for bp in blocks])
+        return self._sendBody(body, len(blocks), x, y, z, retries,
+                              chunkBoxes(blocks))
+
+    def _sendBody(self, body, count, x=0, y=0, z=0, retries=5, boxes=()):
+        """**Send a batch body of count blocks to the server**.
+
+        Connection errors are retried with exponential backoff.
+        The inclusive global `boxes` holding the blocks are marked dirty
+            once the server has answered.
+        """
+        url = self.url + '/blocks?x={}&y={}&z={}'.format(x, y, z)
+        for attempt in range(retries + 1):
+            try:
+                start = perf_counter()
+                response = httpRequest(self.session, "PUT", url, body,
+                                       blocks=count)
+                if self.controller is not None:
+                    self.controller.record(count, perf_counter() - start,
+                                           len(response.content))
+                for box in boxes:
+                    self.markDirty(box)
+                return response.text
+            except requests.exceptions.ConnectionError as e:
+                print("Request failed: {} Retrying ({} left)".format(
+                    e, retries - attempt))
+                if attempt < retries:
+                    metricsUtils.registry.recordRetry("PUT /blocks")
+                    if self.controller is not None:
+                        sleep(self.controller.backoff(attempt))
+                    else:
+                        sleep(backoffDelay(attempt))
+
+    def placeArray(self, origin, volume, palette=None):
+        """**Place a numpy array of block ids with batched requests**.
+
+        `volume` is indexed [x, y, z] from the local position `origin`,
+            its values are ids of `palette`, a BlockRegistry (blockStates
+            by default); a list of block strings `names` becomes one
+            with BlockRegistry(names), whose ids start at 1.
+        Entries equal to KEEP are left untouched.
+        In background mode the batches are queued and None is returned
+            in place of their responses.
+        """
+        if palette is None:
+            palette = blockStates
+        if not isinstance(palette, BlockRegistry):
+            raise TypeError("placeArray needs a BlockRegistry palette, "
+                            "as id 0 is KEEP")
+        names = palette.states
+        volume = np.asarray(volume)
+        xs, ys, zs = np.nonzero(volume != KEEP)
+        if len(xs) == 0:
+            return []
+        ids = volume[xs, ys, zs]
+        gx, gy, gz = self.local2global(*origin)
+
+        self.sendPending()
+        box = (gx + xs.min(), 0, gz + zs.min(), gx + xs.max(), 255,
+               gz + zs.max())
+        if self.cache is not None:
+            self.cache.invalidate(box)
+        body, ends = formatBlockLines(xs + gx, ys + gy, zs + gz, ids, names)
+
+        responses = []
+        limit = self.batchLimit()
+        start = 0
+        for first in range(0, len(ends), limit):
+            last = min(first + limit, len(ends)) - 1
+            # drop the newline ending the last line of the batch
+            batch = body[start:ends[last] - 1]
+            start = ends[last]
+            send = partial(self._sendBody, batch, last - first + 1,
+                           boxes=(box,))
+            if self.backgroundflush:
+                self._startWorker()
+                self.queue.put((send, ()))
+                responses.append(None)
+            else:
+                responses.append(send())
+        return responses
+
+    def plan(self, verbose=False):
+        """**Return a BuildPlan that sends its blocks through this Interface**.
+
+        Pending buffered blocks are sent first.
+        """
+        self.sendPending()
+        return BuildPlan(self, verbose)
+
+    def markDirty(self, box):
+        """**Note that the blocks in an inclusive global box were changed**.
+
+        The chunks are remembered in `dirty` for WorldSlice.refresh
+            and dropped from the chunk cache.
+        """
+        for cx in range(box[0] >> 4, (box[3] >> 4) + 1):
+            for cz in range(box[2] >> 4, (box[5] >> 4) + 1):
+                self.dirty.add((cx, cz))
+        markWritten(box, self)
+
+    def batchLimit(self):
+        """**Return the number of buffered blocks that triggers a send**."""
+        if self.controller is not None:
+            return self.controller.batchsize
+        return self.bufferlimit
+
+    def sendPending(self):
+        """**Send the buffer and wait until every pending block is sent**.
+
+        Unlike flush, batches that failed in the background are kept in
+            `failed` for the next flush.
+        """
+        response = self.sendBlocks()
+        if self.workers:
+            self.queue.join()
+        return response
+
+    def flush(self):
+        """**Send the buffer and wait until every pending block is sent**.
+
+        In background mode returns the queued batches that failed since
+            the last flush, as (function, args) that `function(*args)`
+            sends again; the list is empty if all blocks were sent.
+        """
+        response = self.sendPending()
+        if self.backgroundflush or self.workers:
+            response, self.failed = self.failed, []
+        return response
+
+    def close(self):
+        """**Flush all pending blocks and stop the background workers**.
+
+        Returns the result of the final flush.
+        """
+        response = self.flush()
+        for worker in self.workers:
+            self.queue.put(None)
+        for worker in self.workers:
+            worker.join()
+        self.workers = []
+        if self._exitHook is not None:
+            atexit.unregister(self._exitHook)
+            self._exitHook = None
+        self.closed = True
+        return response
+
+    def _startWorker(self):
+        """**Start background flush threads until there are enough**.
+
+        There is one per batch the controller may send at the same time,
+            which is checked whenever a batch is queued, so a controller
+            attached after the workers started is followed as well.
+        """
+        count = 1 if self.controller is None else self.controller.maxinflight
+        if len(self.workers) >= count:
+            return
+        while len(self.workers) < count:
+            worker = threading.Thread(target=self._flushLoop, daemon=True)
+            worker.start()
+            self.workers.append(worker)
+        # the workers are daemon threads, so they are closed before shutdown
+        if self._exitHook is None:
+            self._exitHook = closeAtExit(self)
+        self.closed = False
+
+    def _flushLoop(self):
+        """**Send queued buffers until the stop signal arrives**."""
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                with self.slots:
+                    # the controller may allow fewer concurrent batches
+                    #   than there are workers
+                    while self.controller is not None \
+                            and self.active >= self.controller.inflight:
+                        self.slots.wait()
+                    self.active += 1
+                try:
+                    function, args = item
+                    if function(*args) is None:
+                        # the retries ran out, see flush
+                        self.failed.append(item)
+                finally:
+                    with self.slots:
+                        self.active -= 1
+                        self.slots.notify_all()
+            except Exception as e:
+                print("Background send failed: {}".format(e))
+                self.failed.append(item)
+            finally:
+                self.queue.task_done()
 
     # ----------------------------------------------------- utility functions
 
@@ -164,13 +722,676 @@ class Interface():
         return result
 
 
+# ----------------------------------------------------- fill helpers
+
+FILL_LIMIT = 32768  # maximum volume of a vanilla fill command
+FILL_MODES = ("destroy", "hollow", "keep", "outline", "replace")
+
+
+def blockName(block):
+    """**Return the namespaced block id without block states**."""
+    name = block.split("[", 1)[0].strip()
+    if ":" not in name:
+        name = "minecraft:" + name
+    return name
+
+
+def boxVolume(box):
+    """**Return the number of blocks in an inclusive box**."""
+    return (box[3] - box[0] + 1) * (box[4] - box[1] + 1) \
+        * (box[5] - box[2] + 1)
+
+
+def splitBox(box, limit=FILL_LIMIT):
+    """**Split an inclusive box into boxes of at most limit blocks**."""
+    if boxVolume(box) <= limit:
+        return [box]
+    sizes = [box[i + 3] - box[i] + 1 for i in range(3)]
+    axis = sizes.index(max(sizes))
+    cross = boxVolume(box) // sizes[axis]
+    if cross > limit:
+        # even a single layer is too large, so halve the longest axis
+        step = sizes[axis] // 2
+    else:
+        step = limit // cross
+    boxes = []
+    for start in range(box[axis], box[axis + 3] + 1, step):
+        piece = list(box)
+        piece[axis] = start
+        piece[axis + 3] = min(start + step - 1, box[axis + 3])
+        boxes += splitBox(tuple(piece), limit)
+    return boxes
+
+
+def boxShell(box):
+    """**Return non-overlapping boxes covering the faces of a box**."""
+    xlo, ylo, zlo, xhi, yhi, zhi = box
+    shell = [(xlo, ylo, zlo, xhi, ylo, zhi)]
+    if yhi > ylo:
+        shell.append((xlo, yhi, zlo, xhi, yhi, zhi))
+    if yhi - ylo < 2:
+        return shell
+    shell.append((xlo, ylo + 1, zlo, xlo, yhi - 1, zhi))
+    if xhi > xlo:
+        shell.append((xhi, ylo + 1, zlo, xhi, yhi - 1, zhi))
+    if xhi - xlo < 2:
+        return shell
+    shell.append((xlo + 1, ylo + 1, zlo, xhi - 1, yhi - 1, zlo))
+    if zhi > zlo:
+        shell.append((xlo + 1, ylo + 1, zhi, xhi - 1, yhi - 1, zhi))
+    return shell
+
+
+def boxInterior(box):
+    """**Return the box without its faces or None if nothing is left**."""
+    interior = (box[0] + 1, box[1] + 1, box[2] + 1,
+                box[3] - 1, box[4] - 1, box[5] - 1)
+    if any(interior[i] > interior[i + 3] for i in range(3)):
+        return None
+    return interior
+
+
+def commandBox(command):
+    """**Return the inclusive box changed by a fill, setblock or clone**.
+
+    Returns None for other commands and for relative coordinates.
+    """
+    words = command.lstrip("/").split()
+    sizes = {"fill": 6, "setblock": 3, "clone": 9}
+    if not words or words[0] not in sizes \
+            or len(words) <= sizes[words[0]]:
+        return None
+    try:
+        coordinates = [int(word) for word in words[1:sizes[words[0]] + 1]]
+    except ValueError:
+        return None
+    if words[0] == "setblock":
+        return (*coordinates, *coordinates)
+    if words[0] == "clone":
+        # the source box is copied to the destination corner
+        source = coordinates[:6]
+        box = [min(source[i], source[i + 3]) for i in range(3)] \
+            + [max(source[i], source[i + 3]) for i in range(3)]
+        coordinates = coordinates[6:] + [coordinates[6 + i] + box[i + 3]
+                                         - box[i] for i in range(3)]
+    return (min(coordinates[0], coordinates[3]),
+            min(coordinates[1], coordinates[4]),
+            min(coordinates[2], coordinates[5]),
+            max(coordinates[0], coordinates[3]),
+            max(coordinates[1], coordinates[4]),
+            max(coordinates[2], coordinates[5]))
+
+
+def fillSucceeded(response):
+    """**Check whether the server accepted a fill command**."""
+    response = response.strip()
+    return response.isnumeric() \
+        or response.startswith("Successfully filled") \
+        or response.startswith("No blocks were filled")
+
+
+# ----------------------------------------------------- block cache
+
+class BlockCache():
+    """**Caches block names in global coordinates, grouped by chunk**.
+
+    Reads are answered from blocks seen or written through the Interface,
+        then from the WorldSlice (if one is given).
+    Only `maxchunks` chunks are kept, the least recently used is evicted.
+    Once a chunk holding our own writes is evicted, the WorldSlice
+        is outdated there and reads of that chunk go to the server.
+    """
+
+    def __init__(self, worldSlice=None, maxchunks=1024):
+        self.worldSlice = worldSlice
+        self.maxchunks = maxchunks
+        self.chunks = OrderedDict()
+        self.written = set()  # cached chunks holding our own writes
+        self.stale = set()  # chunks the WorldSlice no longer represents
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, x, y, z):
+        """**Return the cached block name or None on a miss**."""
+        key = (x >> 4, z >> 4)
+        chunk = self.chunks.get(key)
+        if chunk is not None:
+            self.chunks.move_to_end(key)
+            block = chunk.get((x, y, z))
+            if block is not None:
+                self.hits += 1
+                return block
+        if key not in self.stale and self.inSlice(x, y, z):
+            self.hits += 1
+            return self.worldSlice.getBlockAt((x, y, z))
+        self.misses += 1
+        return None
+
+    def put(self, x, y, z, block):
+        """**Remember the block name reported by the server**."""
+        key = (x >> 4, z >> 4)
+        chunk = self.chunks.get(key)
+        if chunk is None:
+            chunk = self.chunks[key] = {}
+            while len(self.chunks) > self.maxchunks:
+                evicted, _ = self.chunks.popitem(last=False)
+                if evicted in self.written:
+                    self.written.discard(evicted)
+                    self.stale.add(evicted)
+                self.evictions += 1
+        else:
+            self.chunks.move_to_end(key)
+        chunk[(x, y, z)] = block
+
+    def write(self, x, y, z, block):
+        """**Record a block placed by the Interface**."""
+        self.put(x, y, z, blockName(block))
+        self.written.add((x >> 4, z >> 4))
+
+    def invalidate(self, box):
+        """**Forget all chunks touched by an inclusive box**.
+
+        Use this after changing the world without the Interface,
+            e.g. with runCommand.
+        """
+        for cx in range(box[0] >> 4, (box[3] >> 4) + 1):
+            for cz in range(box[2] >> 4, (box[5] >> 4) + 1):
+                self.chunks.pop((cx, cz), None)
+                self.written.discard((cx, cz))
+                self.stale.add((cx, cz))
+
+    def reloaded(self, chunks):
+        """**Read chunks the WorldSlice has fetched again from it**.
+
+        The chunks are (cx, cz) chunk coordinates, see WorldSlice.refresh.
+        """
+        self.stale.difference_update(chunks)
+
+    def inSlice(self, x, y, z):
+        """**Check whether the WorldSlice contains a position**."""
+        if self.worldSlice is None or not 0 <= y < 256:
+            return False
+        rect = self.worldSlice.rect
+        return rect[0] <= x < rect[0] + rect[2] \
+            and rect[1] <= z < rect[1] + rect[3]
+
+    def stats(self):
+        """**Return hit/miss counters and the current size**."""
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses,
+                "hitrate": self.hits / total if total else 0.0,
+                "chunks": len(self.chunks), "evictions": self.evictions}
+
+
+# ----------------------------------------------------- block state registry
+
+KEEP = 0  # block id that placeArray leaves untouched
+
+
+class BlockRegistry():
+    """**Interns block state strings like "oak_log[axis=x]" as integers**.
+
+    Id 0 is reserved for KEEP, so fresh numpy arrays leave blocks untouched.
+    The optional `states` are interned in order, as ids 1, 2, ...
+    """
+
+    def __init__(self, states=()):
+        self.states = ["<keep>"]
+        self.ids = {}
+        for state in states:
+            self.intern(state)
+
+    def intern(self, state):
+        """**Return the id of a block state, registering it if needed**."""
+        id = self.ids.get(state)
+        if id is None:
+            id = self.ids[state] = len(self.states)
+            self.states.append(state)
+        return id
+
+    def __getitem__(self, id):
+        return self.states[id]
+
+    def __len__(self):
+        return len(self.states)
+
+
+# the default registry used by placeArray
+blockStates = BlockRegistry()
+
+
+def formatBlockLines(xs, ys, zs, ids, names):
+    """**Build the "x y z block" lines of a batch request with numpy**.
+
+    Returns the body as bytes with every line ending in a newline,
+        and the offset just after each line.
+    Digits and names are written into one byte buffer per column
+        instead of formatting every line in Python.
+    """
+    columns = [np.asarray(column, dtype=np.int64) for column in (xs, ys, zs)]
+    ids = np.asarray(ids, dtype=np.int64)
+    encoded = [(" " + name + "\n").encode("utf-8") for name in names]
+    nameLengths = np.array([len(name) for name in encoded], dtype=np.int64)
+
+    widths = []
+    for column in columns:
+        digits = np.ones(len(column), dtype=np.int64)
+        magnitude = np.abs(column)
+        for power in range(1, len(str(int(magnitude.max())))):
+            digits += magnitude >= 10 ** power
+        widths.append(digits + (column < 0))
+    lengths = widths[0] + widths[1] + widths[2] + 2 + nameLengths[ids]
+    ends = np.cumsum(lengths)
+    starts = ends - lengths
+
+    buffer = np.full(int(ends[-1]), ord(" "), dtype=np.uint8)
+    position = starts.copy()
+    for column, width in zip(columns, widths):
+        buffer[position[column < 0]] = ord("-")
+        magnitude = np.abs(column)
+        last = position + width - 1
+        for power in range(int(width.max())):
+            # write the digits from the right
+            if power < int(width.min()) - 1:
+                buffer[last - power] = 48 + magnitude % 10
+            else:
+                mask = width - (column < 0) > power
+                buffer[(last - power)[mask]] = 48 + magnitude[mask] % 10
+            magnitude = magnitude // 10
+        position += width + 1
+    position -= 1  # names start with their own space
+    for id in np.unique(ids):
+        rows = position[ids == id]
+        name = np.frombuffer(encoded[id], dtype=np.uint8)
+        buffer[rows[:, None] + np.arange(len(name))] = name
+    return buffer.tobytes(), ends
+
+
+# ----------------------------------------------------- build plans
+
+class BuildPlan():
+    """**Collects placements and commands and sends them in one go**.
+
+    Use it in place of an Interface (e.g. with houseUtils.setInterface)
+        and call `execute()` (or leave the with statement) when done.
+    Reads see the planned blocks, everything else is deferred.
+
+    Before sending, optimizer passes
+    * keep only the last write to each position
+    * drop writes equal to the block known from the Interface's BlockCache
+    * group and sort the writes by chunk
+    Commands are kept in order and act as barriers: the writes before
+        a command are sent before it, and after the first command the
+        cache is no longer trusted to know the current blocks.
+    Block states are not cached, so writes are compared with the known
+        blocks by block id; a write that only changes the block states of
+        the known block is dropped as well.
+    Of a block with fallbacks, the candidate the server accepted before
+        (kept in the Interface's `accepted`) is planned and reported by
+        getBlock; other candidate lists are resolved on `execute()`.
+    The report of `execute()` is returned and kept as `report`; with
+        `verbose` it is printed as well.
+    """
+
+    def __init__(self, interface, verbose=False):
+        self.interface = interface
+        self.verbose = verbose
+        self.steps = []  # lists of writes, separated by commands
+        self.writes = []
+        self.planned = {}
+        self.report = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.execute()
+
+    def getBlock(self, x, y, z):
+        """**Return the planned block or ask the Interface**."""
+        block = self.planned.get(tuple(self.interface.local2global(x, y, z)))
+        if block is not None:
+            return blockName(block)
+        return self.interface.getBlock(x, y, z)
+
+    def placeBlock(self, x, y, z, str, fallbacks=()):
+        """**Plan to place a block, trying fallbacks if the server refuses**.
+
+        Returns "1" as the placement only happens on `execute()`.
+        """
+        position = tuple(self.interface.local2global(x, y, z))
+        candidates = (str, *fallbacks)
+        accepted = self.interface.accepted.get(candidates)
+        if accepted is not None:
+            str, fallbacks = accepted, ()
+        self.writes.append((position, str, tuple(fallbacks), candidates))
+        self.planned[position] = str
+        return "1"
+
+    setBlock = placeBlock
+
+    def runCommand(self, command):
+        """**Plan to run a command after the blocks planned so far**."""
+        self.steps.append(self.writes)
+        self.steps.append(command)
+        self.writes = []
+        return None
+
+    def execute(self, verbose=None):
+        """**Optimize and send the plan, then return the report**.
+
+        `verbose` prints the report, by default if the plan is verbose.
+        """
+        self.steps.append(self.writes)
+        steps, self.steps, self.writes = self.steps, [], []
+        self.planned = {}
+
+        report = {"planned": 0, "overwritten": 0, "unchanged": 0,
+                  "sent": 0, "failed": 0, "commands": 0, "batches": 0}
+        known = self.interface.cache
+        for step in steps:
+            if isinstance(step, str):
+                self.interface.runCommand(step)
+                report["commands"] += 1
+                known = None
+                continue
+            report["planned"] += len(step)
+            writes = self._lastWrites(step)
+            report["overwritten"] += len(step) - len(writes)
+            if known is not None:
+                count = len(writes)
+                writes = [write for write in writes
+                          if not self._isKnown(known, *write)]
+                report["unchanged"] += count - len(writes)
+            writes.sort(key=lambda write: (write[0][0] >> 4, write[0][2] >> 4,
+                                           write[0][1], write[0][0],
+                                           write[0][2]))
+            self._send(writes, report)
+
+        if self.verbose if verbose is None else verbose:
+            print("BuildPlan: {planned} writes planned, {overwritten} "
+                  "overwritten, {unchanged} unchanged, {sent} sent in "
+                  "{batches} batches, {failed} failed, {commands} "
+                  "commands".format(**report))
+        self.report = report
+        return report
+
+    @staticmethod
+    def _lastWrites(writes):
+        """**Keep only the last write to each position**."""
+        last = {}
+        for write in writes:
+            last[write[0]] = write
+        return list(last.values())
+
+    @staticmethod
+    def _isKnown(cache, position, block, fallbacks, candidates):
+        """**Check whether a write would not change the known block id**."""
+        return cache.get(*position) == blockName(block)
+
+    def _send(self, writes, report):
+        """**Send writes in batches, retrying refused ones with fallbacks**."""
+        interface = self.interface
+        limit = interface.batchLimit()
+        while writes:
+            retries = []
+            for start in range(0, len(writes), limit):
+                batch = writes[start:start + limit]
+                response = interface._sendBatch(
+                    [(*write[0], write[1]) for write in batch])
+                report["batches"] += 1
+                lines = [] if response is None else response.splitlines()
+                for index, write in enumerate(batch):
+                    position, block, fallbacks, candidates = write
+                    if index < len(lines) and lines[index].isnumeric():
+                        report["sent"] += 1
+                        if len(candidates) > 1:
+                            interface.accepted[candidates] = block
+                        if interface.cache is not None:
+                            interface.cache.write(*position, block)
+                    elif fallbacks:
+                        retries.append((position, fallbacks[0], fallbacks[1:],
+                                        candidates))
+                    else:
+                        report["failed"] += 1
+            writes = retries
+
+
+class AsyncInterface():
+    """**Asyncio counterpart of the Interface class**.
+
+    Block batches are uploaded concurrently, with at most `maxinflight`
+        PUT requests waiting for the server at any time.
+        With a BatchController its current `inflight` value is used instead.
+    The blocking requests calls are run in a thread pool,
+        so the event loop stays free while they wait for the server.
+    All function parameters and returns are in local coordinates.
+    """
+
+    def __init__(self, offset=(0, 0, 0), maxinflight=4,
+                 host=DEFAULT_HOST, port=DEFAULT_PORT,
+                 poolsize=DEFAULT_POOLSIZE, controller=None):
+        self.offset = offset
+        self.maxinflight = maxinflight
+        self.controller = controller
+        if controller is not None:
+            maxinflight = max(maxinflight, controller.maxinflight)
+        self.url = 'http://{}:{}'.format(host, port)
+        self.session = createSession(max(poolsize, maxinflight))
+        self.executor = ThreadPoolExecutor(max(poolsize, maxinflight))
+        self.pending = set()
+
+    local2global = Interface.local2global
+    global2local = Interface.global2local
+
+    async def _call(self, function, *args, **kwargs):
+        """**Run a blocking session call in the thread pool**."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.executor, partial(function, *args, **kwargs))
+
+    async def requestBuildArea(self):
+        """**Return the building area**."""
+        response = await self._call(httpRequest, self.session, "GET",
+                                    self.url + '/buildarea')
+        if response.ok:
+            buildArea = response.json()
+            if buildArea != -1:
+                x1 = buildArea["xFrom"]
+                z1 = buildArea["zFrom"]
+                x2 = buildArea["xTo"]
+                z2 = buildArea["zTo"]
+                buildArea = (*self.global2local(x1, None, z1),
+                             *self.global2local(x2 - x1, None, z2 - z1))
+            return buildArea
+        else:
+            print(response.text)
+            return -1
+
+    async def getBlock(self, x, y, z):
+        """**Return the name of a block in the world**."""
+        x, y, z = self.local2global(x, y, z)
+
+        url = self.url + '/blocks?x={}&y={}&z={}'.format(x, y, z)
+        try:
+            response = await self._call(httpRequest, self.session, "GET", url)
+        except ConnectionError:
+            return "minecraft:void_air"
+        return response.text
+
+    async def runCommand(self, command):
+        """**Run a Minecraft command in the world**."""
+        try:
+            response = await self._call(httpRequest, self.session, "POST",
+                                        self.url + '/command',
+                                        bytes(command, "utf-8"))
+        except ConnectionError:
+            return "connection error"
+        return response.text
+
+    async def sendBlocks(self, blocks, retries=5):
+        """**Start uploading a batch of blocks and return the upload task**.
+
+        The blocks are (x, y, z, block) tuples in global coordinates.
+        This only waits until fewer than `maxinflight` uploads are pending,
+            await the returned task (or `drain`) for the server response.
+        """
+        while True:
+            running = [task for task in self.pending if not task.done()]
+            if len(running) < self.inflightLimit():
+                break
+            await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+        body = str.join("\n", ['{} {} {} {}'.format(*bp) for bp in blocks])
+        task = asyncio.ensure_future(self._upload(body, len(blocks), retries))
+        self.pending.add(task)
+        task.add_done_callback(self.pending.discard)
+        return task
+
+    def inflightLimit(self):
+        """**Return how many uploads may be pending at once**."""
+        if self.controller is not None:
+            return self.controller.inflight
+        return self.maxinflight
+
+    async def _upload(self, body, blocks, retries):
+        """**PUT a batch body, retrying with exponential backoff**."""
+        for attempt in range(retries + 1):
+            try:
+                start = perf_counter()
+                response = await self._call(
+                    httpRequest, self.session, "PUT", self.url + '/blocks',
+                    body, blocks=blocks)
+                if self.controller is not None:
+                    self.controller.record(blocks, perf_counter() - start,
+                                           len(response.content))
+                return response.text
+            except requests.exceptions.ConnectionError as e:
+                print("Request failed: {} Retrying ({} left)".format(
+                    e, retries - attempt))
+                if attempt < retries:
+                    metricsUtils.registry.recordRetry("PUT /blocks")
+                    if self.controller is not None:
+                        await asyncio.sleep(self.controller.backoff(attempt))
+                    else:
+                        await asyncio.sleep(backoffDelay(attempt))
+
+    async def drain(self):
+        """**Wait for all pending uploads and return their responses**."""
+        if not self.pending:
+            return []
+        return await asyncio.gather(*self.pending)
+
+
+class SyncBridge(Interface):
+    """**Provides the blocking Interface API on top of an AsyncInterface**.
+
+    The event loop runs in a background thread.
+    `sendBlocks` hands the buffer to the loop and returns immediately
+        unless `maxinflight` uploads are already pending,
+        so building continues while the server places the previous batch.
+    Single block calls still wait for the server response.
+    """
+
+    def __init__(self, asyncInterface=None, buffering=False, bufferlimit=4096):
+        if asyncInterface is None:
+            asyncInterface = AsyncInterface()
+        self.interface = asyncInterface
+        super().__init__(asyncInterface.offset, buffering, bufferlimit)
+        self.session.close()
+        self.session = asyncInterface.session
+        self.url = asyncInterface.url
+        self.controller = asyncInterface.controller
+        # chunks of uploads not yet known to be applied (see drain)
+        self.uploadBoxes = set()
+
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever,
+                                       daemon=True)
+        self.thread.start()
+        # the loop thread is a daemon, so it is closed before shutdown
+        self._exitHook = closeAtExit(self)
+
+    def _run(self, coroutine):
+        """**Run a coroutine on the bridge loop and wait for the result**."""
+        if self.closed:
+            coroutine.close()
+            raise RuntimeError("The SyncBridge has been closed")
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def requestBuildArea(self):
+        """**Return the building area**."""
+        return self._run(self.interface.requestBuildArea())
+
+    def _requestBlock(self, x, y, z):
+        """**Ask the server for a block in global coordinates**."""
+        return self._run(self.interface.getBlock(
+            *self.interface.global2local(x, y, z)))
+
+    def runCommand(self, command):
+        """**Run a Minecraft command in the world**.
+
+        Pending uploads are finished first, so the command sees them.
+        """
+        self.drain()
+        response = self._run(self.interface.runCommand(command))
+        box = commandBox(command)
+        if box is not None:
+            self.markDirty(box)
+            if self.cache is not None:
+                self.cache.invalidate(box)
+        return response
+
+    def sendBlocks(self, x=0, y=0, z=0, retries=5):
+        """**Queue the buffer for upload and clear it**.
+
+        Returns None, since the server has not answered yet.
+        Use `drain` to wait for the responses.
+        """
+        if len(self.buffer) == 0:
+            return None
+        blocks, self.buffer = self.buffer, []
+        self._run(self.interface.sendBlocks(blocks, retries))
+        self.uploadBoxes.update(chunkBoxes(blocks))
+        return None
+
+    def drain(self):
+        """**Wait until all queued uploads have been acknowledged**.
+
+        Their chunks are marked dirty afterwards.
+        """
+        self.sendBlocks()
+        response = self._run(self.interface.drain())
+        boxes, self.uploadBoxes = self.uploadBoxes, set()
+        for box in boxes:
+            self.markDirty(box)
+        return response
+
+    flush = drain
+    sendPending = drain
+
+    def close(self):
+        """**Wait for all pending uploads and stop the event loop**."""
+        if self.closed:
+            return
+        self.drain()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        atexit.unregister(self._exitHook)
+        self.closed = True
+
+
 def runCommand(command):
     """**Run a Minecraft command in the world**."""
-    url = 'http://localhost:9000/command'
     try:
-        response = requests.post(url, bytes(command, "utf-8"))
+        response = httpRequest(session, "POST", url + '/command',
+                               bytes(command, "utf-8"))
     except ConnectionError:
         return "connection error"
+    box = commandBox(command)
+    if box is not None:
+        markWritten(box)
     return response.text
 
 
@@ -181,7 +1402,7 @@ def requestBuildArea():
     """**Return the building area (deprecated)**."""
     warnings.warn("Please use the Interface class.", DeprecationWarning)
 
-    response = requests.get('http://localhost:9000/buildarea')
+    response = httpRequest(session, "GET", url + '/buildarea')
     if response.ok:
         return response.json()
     else:
@@ -196,9 +1417,9 @@ def getBlock(x, y, z):
     """**Return the name of a block in the world (deprecated)**."""
     warnings.warn("Please use the Interface class.", DeprecationWarning)
 
-    url = 'http://localhost:9000/blocks?x={}&y={}&z={}'.format(x, y, z)
     try:
-        response = requests.get(url)
+        response = httpRequest(
+            session, "GET", url + '/blocks?x={}&y={}&z={}'.format(x, y, z))
     except ConnectionError:
         return "minecraft:void_air"
     return response.text
@@ -208,11 +1429,13 @@ def setBlock(x, y, z, str):
     """**Place a block in the world (deprecated)**."""
     warnings.warn("Please use the Interface class.", DeprecationWarning)
 
-    url = 'http://localhost:9000/blocks?x={}&y={}&z={}'.format(x, y, z)
     try:
-        response = requests.put(url, str)
+        response = httpRequest(
+            session, "PUT", url + '/blocks?x={}&y={}&z={}'.format(x, y, z),
+            str, blocks=1)
     except ConnectionError:
         return "0"
+    markWritten((x, y, z, x, y, z))
     return response.text
 
 
@@ -238,13 +1461,25 @@ def sendBlocks(x=0, y=0, z=0, retries=5):
     warnings.warn("Please use the Interface class.", DeprecationWarning)
     global blockBuffer
 
-    url = 'http://localhost:9000/blocks?x={}&y={}&z={}'.format(x, y, z)
     body = str.join("\n", ['~{} ~{} ~{} {}'.format(*bp) for bp in blockBuffer])
     try:
-        response = requests.put(url, body)
+        response = httpRequest(
+            session, "PUT", url + '/blocks?x={}&y={}&z={}'.format(x, y, z),
+            body, blocks=len(blockBuffer))
+        for box in chunkBoxes(blockBuffer, x, z):
+            markWritten(box)
         blockBuffer = []
         return response.text
     except ConnectionError as e:
         print("Request failed: {} Retrying ({} left)".format(e, retries))
         if retries > 0:
+            metricsUtils.registry.recordRetry("PUT /blocks")
             return sendBlocks(x, y, z, retries - 1)
+
+
+# trafficUtils and chunkCache read these themselves,
+#   but they have to be imported to do so
+if os.environ.get("GDMC_RECORD") or os.environ.get("GDMC_REPLAY"):
+    import trafficUtils  # noqa: E402,F401
+if os.environ.get("GDMC_CHUNK_CACHE"):
+    import chunkCache as _chunkCache  # noqa: E402,F401
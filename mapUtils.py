@@ -27,16 +27,14 @@ def calcGoodHeightmap(worldSlice):
     heightmapNoTrees = hm_mbnl[:]
     area = worldSlice.rect
 
-    for x in range(area[2]):
-        for z in range(area[3]):
-            while True:
-                y = heightmapNoTrees[x, z]
-                block = worldSlice.getBlockAt(
-                    (area[0] + x, y - 1, area[1] + z))
-                if block[-4:] == '_log':
-                    heightmapNoTrees[x, z] -= 1
-                else:
-                    break
+    # lower all columns standing on a log at once until none does
+    xs, zs = np.nonzero(np.ones((area[2], area[3]), dtype=bool))
+    while len(xs) > 0:
+        ids, _ = worldSlice.getBlocksAt(
+            area[0] + xs, heightmapNoTrees[xs, zs] - 1, area[1] + zs)
+        isLog = worldSlice.classTable("log")[ids]
+        xs, zs = xs[isLog], zs[isLog]
+        heightmapNoTrees[xs, zs] -= 1
 
     return np.array(np.minimum(hm_mbnl, heightmapNoTrees))
 
@@ -0,0 +1,161 @@
+#! /usr/bin/python3
+"""### Collect statistics about the requests sent to the HTTP interface.
+
+This module contains tools to:
+* Count calls, failures and retries per endpoint
+* Sum request/response bytes and placed blocks
+* Record latency histograms
+* Take snapshots and dump them to JSON, e.g. at exit
+
+Recording is opt-in: call `enable()` or set the environment variable
+GDMC_METRICS to the path of a JSON file written at exit.
+"""
+__all__ = ['Histogram', 'MetricsRegistry', 'registry', 'enable', 'disable']
+# __version__
+
+import atexit
+import json
+import os
+import threading
+from bisect import bisect_left
+from time import time
+
+# upper bounds of the latency buckets in seconds (the last one is open)
+LATENCY_BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05,
+                   0.1, 0.2, 0.5, 1, 2, 5, 10)
+
+
+class Histogram():
+    """**Counts observations in fixed buckets**."""
+
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        """**Add a value to the histogram**."""
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def percentile(self, fraction):
+        """**Return the upper bucket bound below which fraction lies**."""
+        if self.count == 0:
+            return None
+        rank = fraction * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def snapshot(self):
+        """**Return the histogram as a dictionary**."""
+        return {"count": self.count, "sum": self.sum,
+                "mean": self.sum / self.count if self.count else None,
+                "min": self.min, "max": self.max,
+                "p50": self.percentile(0.5), "p90": self.percentile(0.9),
+                "p99": self.percentile(0.99),
+                "buckets": dict(zip([str(b) for b in self.bounds] + ["inf"],
+                                    self.counts))}
+
+
+class EndpointMetrics():
+    """**Holds the counters of a single endpoint**."""
+
+    def __init__(self):
+        self.calls = 0
+        self.failures = 0
+        self.retries = 0
+        self.requestBytes = 0
+        self.responseBytes = 0
+        self.blocks = 0
+        self.latency = Histogram()
+
+    def snapshot(self):
+        """**Return the counters as a dictionary**."""
+        return {"calls": self.calls, "failures": self.failures,
+                "retries": self.retries, "requestBytes": self.requestBytes,
+                "responseBytes": self.responseBytes, "blocks": self.blocks,
+                "latency": self.latency.snapshot()}
+
+
+class MetricsRegistry():
+    """**Collects metrics for every endpoint, keyed like "GET /blocks"**."""
+
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.endpoints = {}
+        self.started = time()
+
+    def _endpoint(self, endpoint):
+        metrics = self.endpoints.get(endpoint)
+        if metrics is None:
+            metrics = self.endpoints[endpoint] = EndpointMetrics()
+        return metrics
+
+    def record(self, endpoint, latency, requestBytes=0, responseBytes=0,
+               blocks=0, failed=False):
+        """**Record a finished request**."""
+        if not self.enabled:
+            return
+        with self.lock:
+            metrics = self._endpoint(endpoint)
+            metrics.calls += 1
+            metrics.failures += failed
+            metrics.requestBytes += requestBytes
+            metrics.responseBytes += responseBytes
+            metrics.blocks += blocks
+            metrics.latency.observe(latency)
+
+    def recordRetry(self, endpoint):
+        """**Record that a request is about to be retried**."""
+        if not self.enabled:
+            return
+        with self.lock:
+            self._endpoint(endpoint).retries += 1
+
+    def snapshot(self):
+        """**Return all metrics as a dictionary**."""
+        with self.lock:
+            return {"started": self.started, "taken": time(),
+                    "endpoints": {name: metrics.snapshot() for name, metrics
+                                  in sorted(self.endpoints.items())}}
+
+    def reset(self):
+        """**Forget all recorded metrics**."""
+        with self.lock:
+            self.endpoints = {}
+            self.started = time()
+
+    def dump(self, path):
+        """**Write a snapshot to a JSON file**."""
+        with open(path, "w") as file:
+            json.dump(self.snapshot(), file, indent=2)
+
+
+registry = MetricsRegistry()
+
+
+def enable(path=None):
+    """**Start recording, optionally dumping to path at exit**."""
+    registry.enabled = True
+    if path is not None:
+        atexit.register(registry.dump, path)
+
+
+def disable():
+    """**Stop recording**."""
+    registry.enabled = False
+
+
+if os.environ.get("GDMC_METRICS"):
+    enable(os.environ["GDMC_METRICS"])
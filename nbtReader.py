@@ -0,0 +1,216 @@
+#! /usr/bin/python3
+"""### Read the parts of a /chunks payload that WorldSlice needs.
+
+This module contains a streaming NBT reader that:
+* Walks the payload once without building a tag tree
+* Skips every tag except the heightmaps and the section
+    Y, Palette and BlockStates tags
+* Returns long arrays as big-endian numpy views of the payload
+
+Chunks are yielded as records:
+    {"xPos": int, "zPos": int, "Heightmaps": {name: longs},
+     "Sections": [{"Y": int, "Palette": [{"Name": str,
+                                          "Properties": {str: str}}],
+                   "BlockStates": longs}]}
+Sections without block states are left out.
+"""
+__all__ = ['readChunks']
+# __version__
+
+import struct
+
+import numpy as np
+
+TAG_END = 0
+TAG_BYTE = 1
+TAG_INT = 3
+TAG_STRING = 8
+TAG_LIST = 9
+TAG_COMPOUND = 10
+TAG_LONG_ARRAY = 12
+
+# payload sizes of the fixed-size tags (byte, short, int, long, float, double)
+FIXED_SIZES = {1: 1, 2: 2, 3: 4, 4: 8, 5: 4, 6: 8}
+# element sizes of the array tags (byte, int and long arrays)
+ARRAY_SIZES = {7: 1, 11: 4, 12: 8}
+
+unpackByte = struct.Struct(">b").unpack_from
+unpackShort = struct.Struct(">H").unpack_from
+unpackInt = struct.Struct(">i").unpack_from
+unpackList = struct.Struct(">bi").unpack_from
+
+
+def readChunks(data):
+    """**Yield a record for every chunk in a /chunks payload**.
+
+    `data` may be bytes or any other buffer; the long arrays of the
+        records point into it, so it has to stay alive with them.
+    """
+    tagType, name, pos = readTagHeader(data, 0)
+    if tagType != TAG_COMPOUND:
+        raise ValueError("Chunk data does not start with a compound")
+    while True:
+        tagType, name, pos = readTagHeader(data, pos)
+        if tagType == TAG_END:
+            return
+        if tagType == TAG_LIST and name == b"Chunks":
+            elementType, count = unpackList(data, pos)
+            pos += 5
+            for i in range(count):
+                record = {"Heightmaps": {}, "Sections": []}
+                pos = readCompound(data, pos, CHUNK, record)
+                yield record
+        else:
+            pos = skipPayload(data, pos, tagType)
+
+
+def readTagHeader(data, pos):
+    """**Return the type, name and payload position of a named tag**."""
+    tagType = data[pos]
+    if tagType == TAG_END:
+        return TAG_END, None, pos + 1
+    length, = unpackShort(data, pos + 1)
+    return tagType, bytes(data[pos + 3:pos + 3 + length]), pos + 3 + length
+
+
+def readString(data, pos):
+    """**Return a string payload and the position after it**."""
+    length, = unpackShort(data, pos)
+    return str(data[pos + 2:pos + 2 + length], "utf-8"), pos + 2 + length
+
+
+def readLongs(data, pos):
+    """**Return a long array payload as a view and the position after it**."""
+    count, = unpackInt(data, pos)
+    longs = np.frombuffer(data, dtype=">i8", count=count, offset=pos + 4)
+    return longs, pos + 4 + 8 * count
+
+
+def skipPayload(data, pos, tagType):
+    """**Return the position after the payload of a tag**."""
+    size = FIXED_SIZES.get(tagType)
+    if size is not None:
+        return pos + size
+    size = ARRAY_SIZES.get(tagType)
+    if size is not None:
+        count, = unpackInt(data, pos)
+        return pos + 4 + size * count
+    if tagType == TAG_STRING:
+        length, = unpackShort(data, pos)
+        return pos + 2 + length
+    if tagType == TAG_LIST:
+        elementType, count = unpackList(data, pos)
+        pos += 5
+        size = FIXED_SIZES.get(elementType)
+        if size is not None:
+            return pos + size * count
+        for i in range(count):
+            pos = skipPayload(data, pos, elementType)
+        return pos
+    if tagType == TAG_COMPOUND:
+        while True:
+            tagType, name, pos = readTagHeader(data, pos)
+            if tagType == TAG_END:
+                return pos
+            pos = skipPayload(data, pos, tagType)
+    raise ValueError("Unknown tag type {} at {}".format(tagType, pos))
+
+
+def readCompound(data, pos, readers, record):
+    """**Read a compound, handing the tags in readers to their function**.
+
+    Each reader is called as reader(data, pos, tagType, name, record)
+        and returns the position after the tag; other tags are skipped.
+    """
+    while True:
+        tagType, name, pos = readTagHeader(data, pos)
+        if tagType == TAG_END:
+            return pos
+        reader = readers.get(name)
+        if reader is None:
+            pos = skipPayload(data, pos, tagType)
+        else:
+            pos = reader(data, pos, tagType, name, record)
+
+
+def readLevel(data, pos, tagType, name, record):
+    return readCompound(data, pos, LEVEL, record)
+
+
+def readPosition(data, pos, tagType, name, record):
+    record[name.decode()], = unpackInt(data, pos)
+    return pos + 4
+
+
+def readHeightmaps(data, pos, tagType, name, record):
+    heightmaps = record["Heightmaps"]
+    while True:
+        tagType, name, pos = readTagHeader(data, pos)
+        if tagType == TAG_END:
+            return pos
+        if tagType == TAG_LONG_ARRAY:
+            heightmaps[name.decode()], pos = readLongs(data, pos)
+        else:
+            pos = skipPayload(data, pos, tagType)
+
+
+def readSections(data, pos, tagType, name, record):
+    elementType, count = unpackList(data, pos)
+    pos += 5
+    if elementType != TAG_COMPOUND:
+        for i in range(count):
+            pos = skipPayload(data, pos, elementType)
+        return pos
+    for i in range(count):
+        section = {}
+        pos = readCompound(data, pos, SECTION, section)
+        if "BlockStates" in section and len(section["BlockStates"]) > 0:
+            record["Sections"].append(section)
+    return pos
+
+
+def readY(data, pos, tagType, name, record):
+    record["Y"], = unpackByte(data, pos)
+    return pos + 1
+
+
+def readPalette(data, pos, tagType, name, record):
+    elementType, count = unpackList(data, pos)
+    pos += 5
+    palette = record["Palette"] = []
+    for i in range(count):
+        entry = {"Name": None, "Properties": {}}
+        pos = readCompound(data, pos, PALETTE_ENTRY, entry)
+        palette.append(entry)
+    return pos
+
+
+def readBlockStates(data, pos, tagType, name, record):
+    record["BlockStates"], pos = readLongs(data, pos)
+    return pos
+
+
+def readName(data, pos, tagType, name, record):
+    record["Name"], pos = readString(data, pos)
+    return pos
+
+
+def readProperties(data, pos, tagType, name, record):
+    properties = record["Properties"]
+    while True:
+        tagType, name, pos = readTagHeader(data, pos)
+        if tagType == TAG_END:
+            return pos
+        if tagType == TAG_STRING:
+            properties[name.decode()], pos = readString(data, pos)
+        else:
+            pos = skipPayload(data, pos, tagType)
+
+
+# the tags read from each kind of compound
+CHUNK = {b"Level": readLevel}
+LEVEL = {b"xPos": readPosition, b"zPos": readPosition,
+         b"Heightmaps": readHeightmaps, b"Sections": readSections}
+SECTION = {b"Y": readY, b"Palette": readPalette,
+           b"BlockStates": readBlockStates}
+PALETTE_ENTRY = {b"Name": readName, b"Properties": readProperties}
@@ -0,0 +1,233 @@
+#! /usr/bin/python3
+"""### Record, replay and summarize the traffic to the HTTP interface.
+
+This module contains tools to:
+* Record every request, response and its timing to a trace file
+* Replay a trace instead of talking to a server, at recorded or faster speed
+* Summarize which call sites issued the costliest requests
+
+Traces are gzipped JSON lines. Recording and replaying hook into
+    interfaceUtils.httpRequest, so they cover the Interface classes,
+    the module functions and worldLoader.getChunks.
+Set GDMC_RECORD or GDMC_REPLAY (and GDMC_REPLAY_SPEED) to a trace path
+    to record or replay a script without changing it.
+
+Summarize a trace with:
+    >>> python3 trafficUtils.py trace.jsonl.gz
+"""
+__all__ = ['Recorder', 'Replayer', 'record', 'replay', 'stop', 'summarize']
+# __version__
+
+import argparse
+import atexit
+import base64
+import gzip
+import json
+import os
+import sys
+import threading
+from collections import defaultdict, deque
+from time import perf_counter, sleep
+from urllib.parse import urlsplit
+
+import requests
+
+import interfaceUtils
+
+# frames from these files are skipped when looking for the call site
+TRANSPORT_FILES = ("interfaceUtils.py", "worldLoader.py", "trafficUtils.py",
+                   "metricsUtils.py")
+
+
+def requestKey(method, url, data):
+    """**Return the key used to match replayed requests**."""
+    parts = urlsplit(url)
+    path = parts.path + ("?" + parts.query if parts.query else "")
+    if isinstance(data, bytes):
+        data = data.decode("utf-8", "replace")
+    return method, path, data or ""
+
+
+def callSite(depth=3):
+    """**Return the innermost callers outside the client code**.
+
+    The callers are formatted as "file:function:line" and joined by " < ",
+        so thin wrappers do not hide the function that used them.
+    Requests sent from background threads have no such caller.
+    """
+    sites = []
+    frame = sys._getframe(2)
+    while frame is not None and len(sites) < depth:
+        filename = frame.f_code.co_filename
+        if os.path.basename(filename) not in TRANSPORT_FILES \
+                and "site-packages" not in filename \
+                and not filename.startswith(sys.prefix) \
+                and not filename.startswith(sys.base_prefix):
+            sites.append("{}:{}:{}".format(os.path.basename(filename),
+                                           frame.f_code.co_name,
+                                           frame.f_lineno))
+        frame = frame.f_back
+    return " < ".join(sites) or "<background>"
+
+
+class Recorder():
+    """**Writes every request and response to a gzipped trace file**."""
+
+    def __init__(self, path):
+        self.path = path
+        self.file = gzip.open(path, "wt", encoding="utf-8")
+        self.lock = threading.Lock()
+        self.started = perf_counter()
+        self.count = 0
+
+    def record(self, method, url, data, response, start, duration):
+        """**Append a finished request to the trace**."""
+        method, path, body = requestKey(method, url, data)
+        entry = {"t": round(start - self.started, 6),
+                 "d": round(duration, 6), "m": method, "u": path,
+                 "s": response.status_code,
+                 "h": response.headers.get("Content-Type", ""),
+                 "c": callSite()}
+        if body:
+            entry["q"] = body
+        try:
+            entry["r"] = response.content.decode("utf-8")
+        except UnicodeDecodeError:
+            entry["b"] = base64.b64encode(response.content).decode("ascii")
+        line = json.dumps(entry, separators=(",", ":"))
+        with self.lock:
+            self.file.write(line + "\n")
+            self.count += 1
+
+    def close(self):
+        """**Finish the trace file**."""
+        with self.lock:
+            if not self.file.closed:
+                self.file.close()
+
+
+def loadTrace(path):
+    """**Return the entries of a trace file**."""
+    with gzip.open(path, "rt", encoding="utf-8") as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+class Replayer():
+    """**Answers requests from a trace instead of a server**.
+
+    Identical requests are answered in the order they were recorded.
+    Each response is delayed by its recorded duration divided by `speed`;
+        a speed of 0 answers immediately.
+    """
+
+    def __init__(self, path, speed=1.0):
+        self.speed = speed
+        self.responses = defaultdict(deque)
+        self.lock = threading.Lock()
+        self.misses = 0
+        for entry in loadTrace(path):
+            key = (entry["m"], entry["u"], entry.get("q", ""))
+            self.responses[key].append(entry)
+
+    def request(self, method, url, data=None):
+        """**Return the recorded response to a request**."""
+        key = requestKey(method, url, data)
+        with self.lock:
+            queue = self.responses.get(key)
+            entry = queue.popleft() if queue else None
+            if entry is None:
+                self.misses += 1
+        response = requests.models.Response()
+        response.url = url
+        response.encoding = "utf-8"
+        if entry is None:
+            response.status_code = 404
+            response._content = "No recorded response for {} {}".format(
+                *key[:2]).encode("utf-8")
+            return response
+        if self.speed > 0:
+            sleep(entry["d"] / self.speed)
+        response.status_code = entry["s"]
+        response.headers["Content-Type"] = entry["h"]
+        if "b" in entry:
+            response._content = base64.b64decode(entry["b"])
+        else:
+            response._content = entry["r"].encode("utf-8")
+        return response
+
+
+def record(path):
+    """**Start recording all requests to path**."""
+    stop()
+    interfaceUtils.recorder = Recorder(path)
+    atexit.register(interfaceUtils.recorder.close)
+    return interfaceUtils.recorder
+
+
+def replay(path, speed=1.0):
+    """**Answer all requests from the trace at path**."""
+    stop()
+    interfaceUtils.replayer = Replayer(path, speed)
+    return interfaceUtils.replayer
+
+
+def stop():
+    """**Stop recording and replaying**."""
+    if interfaceUtils.recorder is not None:
+        interfaceUtils.recorder.close()
+    interfaceUtils.recorder = None
+    interfaceUtils.replayer = None
+
+
+def summarize(path, top=10, depth=2):
+    """**Print the costliest call sites and endpoints of a trace**.
+
+    Call sites are grouped by their innermost `depth` callers.
+    """
+    sites = defaultdict(lambda: [0, 0.0, 0])
+    endpoints = defaultdict(lambda: [0, 0.0, 0])
+    entries = loadTrace(path)
+    for entry in entries:
+        endpoint = entry["m"] + " " + entry["u"].split("?", 1)[0]
+        size = len(entry.get("r", "")) + len(entry.get("b", "")) * 3 // 4
+        site = " < ".join(entry["c"].split(" < ")[:depth])
+        for key, table in (((site, endpoint), sites),
+                           (endpoint, endpoints)):
+            table[key][0] += 1
+            table[key][1] += entry["d"]
+            table[key][2] += size
+
+    print("{} requests, {:.3f} s waiting for the server".format(
+        len(entries), sum(entry["d"] for entry in entries)))
+    print("\n{:<14} {:>8} {:>10} {:>12}".format(
+        "endpoint", "calls", "seconds", "bytes"))
+    for endpoint, (calls, seconds, size) in sorted(
+            endpoints.items(), key=lambda item: -item[1][1]):
+        print("{:<14} {:>8} {:>10.3f} {:>12}".format(
+            endpoint, calls, seconds, size))
+    print("\n{:<64} {:<14} {:>8} {:>10}".format(
+        "call site", "endpoint", "calls", "seconds"))
+    for (site, endpoint), (calls, seconds, size) in sorted(
+            sites.items(), key=lambda item: -item[1][1])[:top]:
+        print("{:<64} {:<14} {:>8} {:>10.3f}".format(
+            site, endpoint, calls, seconds))
+    return sites
+
+
+if os.environ.get("GDMC_RECORD"):
+    record(os.environ["GDMC_RECORD"])
+elif os.environ.get("GDMC_REPLAY"):
+    replay(os.environ["GDMC_REPLAY"],
+           float(os.environ.get("GDMC_REPLAY_SPEED", 1.0)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("trace", help="trace file to summarize")
+    parser.add_argument("--top", type=int, default=10,
+                        help="number of call sites to list")
+    parser.add_argument("--depth", type=int, default=2,
+                        help="number of callers that make up a call site")
+    args = parser.parse_args()
+
+    summarize(args.trace, args.top, args.depth)
@@ -1,6 +1,6 @@
 # ! /usr/bin/python3
 """### Displays a map of the build area."""
-__all__ = ['WorldSlice']
+__all__ = ['renderMap', 'renderTiles']
 # __version__
 
 import blockColors
@@ -12,24 +12,17 @@ from worldLoader import WorldSlice
 
 rect = (0, 0, 128, 128)  # default build area
 
-if __name__ == '__main__':
-    # see if a different build area was defined ingame
-    buildArea = interfaceUtils.requestBuildArea()
-    if buildArea != -1:
-        x1 = buildArea["xFrom"]
-        z1 = buildArea["zFrom"]
-        x2 = buildArea["xTo"]
-        z2 = buildArea["zTo"]
-        # DEBUG: print(buildArea)
-        rect = (x1, z1, x2 - x1, z2 - z1)
-        # DEBUG: print(rect)
 
-    # load the world data and extract the heightmap(s)
-    slice = WorldSlice(rect)
+def renderMap(worldSlice):
+    """**Return an RGB image of the surface blocks of a WorldSlice.**
 
+    The image is indexed [z, x], unknown block ids are returned as a set.
+    """
+    rect = worldSlice.rect
     heightmap1 = np.array(
-        slice.heightmaps["MOTION_BLOCKING_NO_LEAVES"], dtype=np.uint8)
-    heightmap2 = np.array(slice.heightmaps["OCEAN_FLOOR"], dtype=np.uint8)
+        worldSlice.heightmaps["MOTION_BLOCKING_NO_LEAVES"], dtype=np.uint8)
+    heightmap2 = np.array(
+        worldSlice.heightmaps["OCEAN_FLOOR"], dtype=np.uint8)
     heightmap = np.minimum(heightmap1, heightmap2)
 
     # calculate the gradient (steepness)
@@ -44,32 +37,23 @@ if __name__ == '__main__':
             palette[block] = hex
 
     # create a 2d map containing the surface block colors
-    topcolor = np.zeros((rect[2], rect[3]), dtype='int')
-    unknownBlocks = set()
-
-    for dx in range(rect[2]):
-        for dz in range(rect[3]):
-            # check up to 5 blocks below the heightmap
-            for dy in range(5):
-                # calculate absolute coordinates
-                x = rect[0] + dx
-                z = rect[1] + dz
-                y = int(heightmap1[(dx, dz)]) - dy
-
-                blockID = slice.getBlockAt((x, y, z))
-                if blockID in blockColors.TRANSPARENT:
-                    # transparent blocks are ignored
-                    continue
-                else:
-                    if blockID not in palette:
-                        # unknown blocks remembered for debug purposes
-                        unknownBlocks.add(blockID)
-                    else:
-                        topcolor[(dx, dz)] = palette[blockID]
-                    break
-
-    if len(unknownBlocks) > 0:
-        print("Unknown blocks: " + str(unknownBlocks))
+    # check up to 5 blocks below the heightmap of every column at once
+    xs = rect[0] + np.arange(rect[2])[:, None, None]
+    zs = rect[1] + np.arange(rect[3])[None, :, None]
+    ys = heightmap1.astype(int)[:, :, None] - np.arange(5)
+    ids, blockIDs = worldSlice.getBlocksAt(xs, ys, zs)
+
+    # transparent blocks are ignored, the first other block is used
+    opaque = ~worldSlice.classTable("transparent")[ids]
+    found = opaque.any(axis=2)
+    top = np.take_along_axis(ids, opaque.argmax(axis=2)[:, :, None],
+                             axis=2)[:, :, 0]
+    colors = np.array([palette.get(blockID, 0) for blockID in blockIDs])
+    topcolor = np.where(found, colors[top], 0)
+
+    # unknown blocks remembered for debug purposes
+    unknownBlocks = {blockIDs[id] for id in np.unique(top[found])
+                     if blockIDs[id] not in palette}
 
     # separate the color map into three separate color channels
     topcolor = cv2.merge(((topcolor) & 0xff, (topcolor >> 8)
@@ -82,10 +66,52 @@ if __name__ == '__main__':
     topcolor += brightness
     topcolor = topcolor.clip(0, 255)
 
-    # display the map
     topcolor = topcolor.astype('uint8')
     topcolor = np.transpose(topcolor, (1, 0, 2))
-    plt_image = cv2.cvtColor(topcolor, cv2.COLOR_BGR2RGB)
+    return cv2.cvtColor(topcolor, cv2.COLOR_BGR2RGB), unknownBlocks
+
+
+def renderTiles(tiles):
+    """**Return an RGB image of a WorldTiles area, rendered tile by tile.**
+
+    Tiles need an overlap of at least 1 for their borders to be shaded
+        like those of a single WorldSlice. Returns the same as renderMap.
+    """
+    rect = tiles.rect
+    image = np.zeros((rect[3], rect[2], 3), dtype=np.uint8)
+    unknownBlocks = set()
+    for core, worldSlice in tiles:
+        tileImage, tileUnknownBlocks = renderMap(worldSlice)
+        # the images are indexed [z, x]
+        ox = core[0] - worldSlice.rect[0]
+        oz = core[1] - worldSlice.rect[1]
+        image[core[1] - rect[1]:core[1] - rect[1] + core[3],
+              core[0] - rect[0]:core[0] - rect[0] + core[2]] = \
+            tileImage[oz:oz + core[3], ox:ox + core[2]]
+        unknownBlocks |= tileUnknownBlocks
+    return image, unknownBlocks
+
+
+if __name__ == '__main__':
+    # see if a different build area was defined ingame
+    buildArea = interfaceUtils.requestBuildArea()
+    if buildArea != -1:
+        x1 = buildArea["xFrom"]
+        z1 = buildArea["zFrom"]
+        x2 = buildArea["xTo"]
+        z2 = buildArea["zTo"]
+        # DEBUG: print(buildArea)
+        rect = (x1, z1, x2 - x1, z2 - z1)
+        # DEBUG: print(rect)
+
+    # load the world data; heightmaps and sections are decoded when used
+    slice = WorldSlice(rect, lazy=True)
 
+    plt_image, unknownBlocks = renderMap(slice)
+
+    if len(unknownBlocks) > 0:
+        print("Unknown blocks: " + str(unknownBlocks))
+
+    # display the map
     plt.imshow(plt_image)
     plt.show()
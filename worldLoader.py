@@ -5,28 +5,40 @@ This module contains functions to:
 * Calculate a heightmap ideal for building
 * Visualise numpy arrays
 """
-__all__ = ['WorldSlice']
+__all__ = ['WorldSlice', 'WorldTiles']
 # __version__
 
+import sys
+from collections import OrderedDict
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from io import BytesIO
 from math import ceil, log2
 
 import nbt
 import numpy as np
-import requests
 
+import interfaceUtils
 from bitarray import BitArray
+from blockClasses import PredicateIndex
+from nbtReader import readChunks
 
 
-def getChunks(x, z, dx, dz, rtype='text'):
-    """**Get raw chunk data.**"""
+def getChunks(x, z, dx, dz, rtype='text', interface=None):
+    """**Get raw chunk data.**
+
+    Uses the connection of `interface` if given,
+        otherwise the module-level connection of interfaceUtils.
+    """
     print("getting chunks {} {} {} {} ".format(x, z, dx, dz))
 
-    url = 'http://localhost:9000/chunks?x={}&z={}&dx={}&dz={}'.format(
+    connection = interfaceUtils if interface is None else interface
+    url = connection.url + '/chunks?x={}&z={}&dx={}&dz={}'.format(
         x, z, dx, dz)
     print("request url: {}".format(url))
     acceptType = 'application/octet-stream' if rtype == 'bytes' else 'text/raw'
-    response = requests.get(url, headers={"Accept": acceptType})
+    response = interfaceUtils.httpRequest(connection.session, "GET", url,
+                                          headers={"Accept": acceptType})
     print("result: {}".format(response.status_code))
     if response.status_code >= 400:
         print("error: {}".format(response.text))
@@ -37,90 +49,629 @@ def getChunks(x, z, dx, dz, rtype='text'):
         return response.content
 
 
+def chunkRectOf(rect):
+    """**Return the chunk rect (x, z, dx, dz) touched by a block rect.**"""
+    return (rect[0] >> 4, rect[1] >> 4,
+            ((rect[0] + rect[2] - 1) >> 4) - (rect[0] >> 4) + 1,
+            ((rect[1] + rect[3] - 1) >> 4) - (rect[1] >> 4) + 1)
+
+
+def chunkTiles(x, z, dx, dz, tilesize):
+    """**Split a chunk rect into tiles of at most tilesize x tilesize.**"""
+    return [(tx, tz, min(tilesize, x + dx - tx), min(tilesize, z + dz - tz))
+            for tz in range(z, z + dz, tilesize)
+            for tx in range(x, x + dx, tilesize)]
+
+
+def readChunkRecords(x, z, dx, dz, interface=None, keepNbt=False):
+    """**Fetch a chunk rect and return its chunk records.**
+
+    The records are those of nbtReader.readChunks, ordered x first,
+        then z.
+    With `keepNbt` returns (records, nbtfile), where nbtfile is the
+        NBT file parsed from the same payload by the nbt package.
+    """
+    bytes = getChunks(x, z, dx, dz, rtype='bytes', interface=interface)
+    records = list(readChunks(memoryview(bytes)))
+    if keepNbt:
+        return records, nbt.nbt.NBTFile(buffer=BytesIO(bytes))
+    return records
+
+
+def getChunksTiled(x, z, dx, dz, tilesize=8, workers=4, interface=None,
+                   keepNbt=False):
+    """**Fetch and parse a chunk rect tile by tile, several at a time.**
+
+    Returns the chunk records like those of a single /chunks request,
+        ordered x first, then z.
+    With `keepNbt` returns (records, nbtfile), where the 'Chunks' list
+        of nbtfile holds the chunk compounds in the same order.
+    """
+    def load(tile):
+        return tile, readChunkRecords(*tile, interface=interface,
+                                      keepNbt=keepNbt)
+
+    chunks = [None] * (dx * dz)
+    compounds = [None] * (dx * dz)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for tile, loaded in executor.map(
+                load, chunkTiles(x, z, dx, dz, tilesize)):
+            tx, tz, tdx, tdz = tile
+            records, tileFile = loaded if keepNbt else (loaded, None)
+            for index, chunk in enumerate(records):
+                cx = tx - x + index % tdx
+                cz = tz - z + index // tdx
+                chunks[cx + cz * dx] = chunk
+                if tileFile is not None:
+                    compounds[cx + cz * dx] = tileFile['Chunks'][index]
+    if not keepNbt:
+        return chunks
+
+    nbtfile = nbt.nbt.NBTFile()
+    nbtfile.name = ""
+    nbtfile.tags.append(nbt.nbt.TAG_List(type=nbt.nbt.TAG_Compound,
+                                         name='Chunks'))
+    nbtfile['Chunks'].tags.extend(compounds)
+    return chunks, nbtfile
+
+
+def decodeHeightmap(chunk, hmName):
+    """**Decode a heightmap of a chunk record into a 16x16 [x, z] array.**"""
+    hmRaw = chunk['Heightmaps'][hmName]
+    # entries are stored in z, x order
+    return BitArray(9, 16 * 16, hmRaw).array.reshape(16, 16).T
+
+
+def decodeSection(section):
+    """**Decode a section record into (palette, BitArray).**
+
+    Returns None for sections without blocks.
+    """
+    if not ('BlockStates' in section) or len(section['BlockStates']) == 0:
+        return None
+
+    palette = section['Palette']
+    bitsPerEntry = max(4, ceil(log2(len(palette))))
+    blockStatesBitArray = BitArray(
+        bitsPerEntry, 16 * 16 * 16, section['BlockStates'])
+    return palette, blockStatesBitArray
+
+
+def decodeChunk(chunk, heightmapTypes):
+    """**Decode the heightmaps and sections of a chunk record.**
+
+    Heightmaps are 16x16 arrays indexed [x, z], sections are
+        (y, palette, BitArray) tuples.
+    """
+    heightmaps = {hmName: decodeHeightmap(chunk, hmName)
+                  for hmName in heightmapTypes}
+    sections = []
+    for section in chunk['Sections']:
+        decoded = decodeSection(section)
+        if decoded is not None:
+            sections.append((section['Y'], *decoded))
+    return heightmaps, sections
+
+
+def decodeChunksCompact(bytes, heightmapTypes):
+    """**Parse a /chunks payload into picklable numpy data.**
+
+    This runs in worker processes: BitArrays are reduced to their
+        bits per entry and decoded values.
+    """
+    chunks = []
+    for chunk in readChunks(memoryview(bytes)):
+        heightmaps, sections = decodeChunk(chunk, heightmapTypes)
+        compactSections = [
+            (y, palette, bitArray.bitsPerEntry, bitArray.array)
+            for y, palette, bitArray in sections]
+        chunks.append((heightmaps, compactSections))
+    return chunks
+
+
+def getChunksDecoded(x, z, dx, dz, heightmapTypes, tilesize=4, workers=4,
+                     processes=None, interface=None):
+    """**Fetch tiles in threads and decode them in a process pool.**
+
+    Every tile is handed to the pool as soon as it arrives.
+    Returns (heightmaps, sections) per chunk, ordered x first, then z,
+        with sections rebuilt as (y, palette, BitArray) tuples.
+    """
+    chunks = [None] * (dx * dz)
+    with ProcessPoolExecutor(max_workers=processes) as pool, \
+            ThreadPoolExecutor(max_workers=workers) as executor:
+        def load(tile):
+            bytes = getChunks(*tile, rtype='bytes', interface=interface)
+            return tile, pool.submit(decodeChunksCompact, bytes,
+                                     heightmapTypes)
+
+        for tile, future in list(executor.map(
+                load, chunkTiles(x, z, dx, dz, tilesize))):
+            tx, tz, tdx, tdz = tile
+            for index, (heightmaps, sections) in enumerate(future.result()):
+                sections = [(y, palette, BitArray(bits, 16 * 16 * 16, None,
+                                                  values=states))
+                            for y, palette, bits, states in sections]
+                chunks[tx - x + index % tdx
+                       + (tz - z + index // tdx) * dx] = (heightmaps,
+                                                          sections)
+    return chunks
+
+
 class CachedSection:
-    """**Represents a cached chunk section (16x16x16).**"""
+    """**Represents a cached chunk section (16x16x16).**
 
-    def __init__(self, palette, blockStatesBitArray):
+    `states` holds the palette index of every block in y, z, x order,
+        in uint8 if the palette allows it. Sections of a single block
+        have no states (None) and a palette of only that block.
+    """
+
+    def __init__(self, palette, states):
         self.palette = palette
-        self.blockStatesBitArray = blockStatesBitArray
+        self.states = states
 
+    @property
+    def names(self):
+        """**The block names of the palette.**"""
+        return [entry["Name"] for entry in self.palette]
 
-class WorldSlice:
-    """**Contains information on a slice of the world.**"""
-    # TODO format this to blocks
+    def getAt(self, index):
+        """**Return the palette entry at an index in y, z, x order.**"""
+        if self.states is None:
+            return self.palette[0]
+        return self.palette[self.states[index]]
 
-    def __init__(self, rect, heightmapTypes=["MOTION_BLOCKING", "MOTION_BLOCKING_NO_LEAVES", "OCEAN_FLOOR", "WORLD_SURFACE"]):
-        self.rect = rect
-        self.chunkRect = (rect[0] >> 4, rect[1] >> 4, ((rect[0] + rect[2] - 1) >> 4) - (
-            rect[0] >> 4) + 1, ((rect[1] + rect[3] - 1) >> 4) - (rect[1] >> 4) + 1)
-        self.heightmapTypes = heightmapTypes
 
-        bytes = getChunks(*self.chunkRect, rtype='bytes')
-        file_like = BytesIO(bytes)
+class LazyHeightmaps(Mapping):
+    """**Assembles the heightmaps of a lazy WorldSlice on first access.**"""
+
+    def __init__(self, worldSlice):
+        self.worldSlice = worldSlice
+        self.decoded = {}
 
-        print("parsing NBT")
-        self.nbtfile = nbt.nbt.NBTFile(buffer=file_like)
+    def __getitem__(self, hmName):
+        if hmName not in self.decoded:
+            if hmName not in self.worldSlice.heightmapTypes:
+                raise KeyError(hmName)
+            chunks = self.worldSlice.rawChunks
+            width = self.worldSlice.chunkRect[2]
+            self.decoded[hmName] = self.worldSlice.assembleHeightmap(
+                lambda x, z: decodeHeightmap(chunks[x + z * width], hmName))
+        return self.decoded[hmName]
 
-        rectOffset = [rect[0] % 16, rect[1] % 16]
+    def __iter__(self):
+        return iter(self.worldSlice.heightmapTypes)
 
-        # heightmaps
-        self.heightmaps = {}
-        for hmName in self.heightmapTypes:
-            self.heightmaps[hmName] = np.zeros(
-                (rect[2], rect[3]), dtype=np.int)
+    def __len__(self):
+        return len(self.worldSlice.heightmapTypes)
 
+
+class WorldSlice:
+    """**Contains information on a slice of the world.**"""
+    # TODO format this to blocks
+
+    def __init__(self, rect, heightmapTypes=["MOTION_BLOCKING",
+                                             "MOTION_BLOCKING_NO_LEAVES",
+                                             "OCEAN_FLOOR", "WORLD_SURFACE"],
+                 interface=None, dense=False, tilesize=None, workers=4,
+                 processes=None, lazy=False, cache=None, keepNbt=False):
+        """**Load the chunks touching rect.**
+
+        With `tilesize` the chunk rect is fetched in tiles of at most
+            tilesize x tilesize chunks by `workers` threads, and each tile
+            is parsed as soon as it arrives. Otherwise a single request
+            fetches all chunks.
+        With `processes` the tiles (of 4x4 chunks by default) are parsed
+            and decoded by that many worker processes instead. Scripts
+            using this must guard their entry point with
+            `if __name__ == '__main__'`.
+        With `lazy` the parsed chunks are kept and every heightmap and
+            section is only decoded when first used (see `stats`).
+            This does not apply to `processes`.
+        With a ChunkCache as `cache` (by default the one enabled with
+            chunkCache.enable, False for none) stored chunks are
+            memory-mapped and only the others are requested.
+        The payloads are read with nbtReader, which only extracts the
+            heightmaps and sections, so section palettes hold {"Name":
+            ..., "Properties": {...}} dicts and no NBT tree is kept.
+        With `keepNbt` the payloads are also parsed by the nbt package
+            and kept as `nbtfile`, whose 'Chunks' list follows refresh.
+            Otherwise, and with `processes` or `cache`, `nbtfile` is None.
+        Sections are kept compact (see compactSection), their memory
+            is reported by `memoryFootprint`.
+        """
+        self.rect = rect
+        self.chunkRect = chunkRectOf(rect)
+        self.heightmapTypes = heightmapTypes
+        if cache is None:
+            cache = interfaceUtils.chunkCache
+        self.cache = cache
+        self.interface = interface
+        self.lazy = lazy and processes is None and not cache
+        self.nbtfile = None
+        keepNbt = keepNbt and processes is None and not cache
+        records = None
+
+        if cache:
+            print("loading chunks from the cache")
+            chunks = cache.load(self.chunkRect, heightmapTypes, interface)
+        elif processes is not None:
+            print("decoding chunks in {} processes".format(processes))
+            chunks = getChunksDecoded(*self.chunkRect, heightmapTypes,
+                                      tilesize or 4, workers, processes,
+                                      interface)
+        elif tilesize is None:
+            records = readChunkRecords(*self.chunkRect, interface=interface,
+                                       keepNbt=keepNbt)
+        else:
+            records = getChunksTiled(*self.chunkRect, tilesize, workers,
+                                     interface, keepNbt)
+        if keepNbt:
+            records, self.nbtfile = records
+
+        # interned palette entries and palettes (see compactSection)
+        self.paletteEntries = {}
+        self.palettes = {}
+        self.sectionsOmitted = 0
         # Sections are in x,z,y order!!! (reverse minecraft order :p)
         self.sections = [[[None for i in range(16)] for z in range(
             self.chunkRect[3])] for x in range(self.chunkRect[2])]
 
-        # heightmaps
-        print("extracting heightmaps")
+        if self.lazy:
+            self.rawChunks = records
+            # section records by y of every chunk indexed so far
+            self.rawSections = {}
+            self.heightmaps = LazyHeightmaps(self)
+        else:
+            if records is not None:
+                print("extracting chunks")
+                chunks = [decodeChunk(chunk, heightmapTypes)
+                          for chunk in records]
+
+            width = self.chunkRect[2]
+            self.heightmaps = {}
+            for hmName in self.heightmapTypes:
+                self.heightmaps[hmName] = self.assembleHeightmap(
+                    lambda x, z: chunks[x + z * width][0][hmName])
+
+            for x in range(self.chunkRect[2]):
+                for z in range(self.chunkRect[3]):
+                    for y, palette, blockStatesBitArray \
+                            in chunks[x + z * width][1]:
+                        self.sections[x][z][y] = self.compactSection(
+                            palette, blockStatesBitArray)
+            # release the payloads, the compact sections do not use them
+            del chunks, records
+
+        # dense volume (see buildVolume)
+        self.volume = None
+        self.palette = None
+        self.paletteIndices = None
+        self.predicates = None  # class tables of palette (see classTable)
+        if dense:
+            print("building volume")
+            self.buildVolume()
 
+        print("done")
+
+    def assembleHeightmap(self, chunkHeightmap):
+        """**Join the 16x16 heightmaps of all chunks and crop them to rect.**
+
+        `chunkHeightmap(x, z)` returns the heightmap of a chunk,
+            counted from the corner of the chunk rect.
+        """
+        rectOffset = [self.rect[0] % 16, self.rect[1] % 16]
+        heightmap = np.zeros(
+            (self.chunkRect[2] * 16, self.chunkRect[3] * 16), dtype=int)
         for x in range(self.chunkRect[2]):
             for z in range(self.chunkRect[3]):
-                chunkID = x + z * self.chunkRect[2]
-
-                hms = self.nbtfile['Chunks'][chunkID]['Level']['Heightmaps']
-                for hmName in self.heightmapTypes:
-                    # hmRaw = hms['MOTION_BLOCKING']
-                    hmRaw = hms[hmName]
-                    heightmapBitArray = BitArray(9, 16 * 16, hmRaw)
-                    heightmap = self.heightmaps[hmName]
-                    for cz in range(16):
-                        for cx in range(16):
-                            try:
-                                heightmap[-rectOffset[0] + x * 16 + cx, -rectOffset[1] +
-                                          z * 16 + cz] = heightmapBitArray.getAt(cz * 16 + cx)
-                            except IndexError:
-                                pass
-
-        # sections
-        print("extracting chunk sections")
-
+                heightmap[x * 16:(x + 1) * 16, z * 16:(z + 1) * 16] = \
+                    chunkHeightmap(x, z)
+        return heightmap[rectOffset[0]:rectOffset[0] + self.rect[2],
+                         rectOffset[1]:rectOffset[1] + self.rect[3]].copy()
+
+    def getSection(self, x, z, y):
+        """**Return the CachedSection of a chunk, counted from chunkRect.**
+
+        Returns None for missing sections. Lazy slices decode it here.
+        """
+        if not 0 <= y < 16:
+            return None
+        cachedSection = self.sections[x][z][y]
+        if cachedSection is not None or not self.lazy:
+            return cachedSection
+
+        rawSections = self.rawSections.get((x, z))
+        if rawSections is None:
+            chunk = self.rawChunks[x + z * self.chunkRect[2]]
+            rawSections = self.rawSections[(x, z)] = {
+                section['Y']: section for section in chunk['Sections']}
+        section = rawSections.pop(y, None)
+        decoded = None if section is None else decodeSection(section)
+        if decoded is not None:
+            cachedSection = self.sections[x][z][y] = \
+                self.compactSection(*decoded)
+        return cachedSection
+
+    def compactSection(self, palette, blockStatesBitArray):
+        """**Turn a decoded section into a compact CachedSection.**
+
+        Sections of a single block are collapsed, those of only air
+            are omitted (None). Equal palette entries and palettes are
+            shared by all sections of the slice, and block names are
+            interned. The BitArray and its long array are not kept.
+        """
+        states = blockStatesBitArray.array
+        if len(palette) > 1 and (states == states[0]).all():
+            palette = [palette[states[0]]]
+        if len(palette) == 1:
+            states = None
+            if palette[0]["Name"] == "minecraft:air":
+                self.sectionsOmitted += 1
+                return None
+        elif len(palette) <= 256 and not isinstance(states, np.memmap):
+            # memory-mapped states stay on disk
+            states = states.astype(np.uint8)
+
+        entries = []
+        for entry in palette:
+            properties = tuple(sorted(entry["Properties"].items()))
+            key = (entry["Name"], properties)
+            shared = self.paletteEntries.get(key)
+            if shared is None:
+                shared = self.paletteEntries[key] = {
+                    "Name": sys.intern(entry["Name"]),
+                    "Properties": {sys.intern(name): sys.intern(value)
+                                   for name, value in properties}}
+            entries.append(shared)
+        key = tuple(id(entry) for entry in entries)
+        palette = self.palettes.get(key)
+        if palette is None:
+            palette = self.palettes[key] = entries
+        return CachedSection(palette, states)
+
+    def stats(self):
+        """**Report how many heightmaps and sections have been decoded.**"""
+        sections = sum(section is not None for column in self.sections
+                       for sections in column for section in sections)
+        if self.lazy:
+            heightmaps = len(self.heightmaps.decoded)
+            # sections of indexed chunks that are still raw
+            pending = sum(
+                'BlockStates' in section and len(section['BlockStates']) > 0
+                for rawSections in self.rawSections.values()
+                for section in rawSections.values())
+            chunksIndexed = len(self.rawSections)
+        else:
+            heightmaps = len(self.heightmaps)
+            pending = 0
+            chunksIndexed = self.chunkRect[2] * self.chunkRect[3]
+        return {"lazy": self.lazy,
+                "chunks": self.chunkRect[2] * self.chunkRect[3],
+                "chunksIndexed": chunksIndexed,
+                "heightmaps": heightmaps,
+                "heightmapTypes": len(self.heightmapTypes),
+                "sectionsDecoded": sections,
+                "sectionsPending": pending}
+
+    def memoryFootprint(self):
+        """**Report the memory held by the slice in bytes.**
+
+        Memory-mapped states are counted separately, as they stay on disk
+            until read. `raw` counts the payloads that lazy slices keep
+            for chunks they have not fully decoded.
+        """
+        sections = [section for column in self.sections
+                    for sections in column for section in sections
+                    if section is not None]
+        states = sum(section.states.nbytes for section in sections
+                     if section.states is not None
+                     and not isinstance(section.states, np.memmap))
+        mapped = sum(section.states.nbytes for section in sections
+                     if isinstance(section.states, np.memmap))
+        palettes = sum(sys.getsizeof(palette)
+                       for palette in self.palettes.values())
+        for (name, properties), entry in self.paletteEntries.items():
+            palettes += sys.getsizeof(entry) + sys.getsizeof(name) \
+                + sys.getsizeof(entry["Properties"]) + sum(
+                    sys.getsizeof(key) + sys.getsizeof(value)
+                    for key, value in properties)
+        heightmaps = self.heightmaps.decoded if self.lazy else self.heightmaps
+        raw = 0
+        if self.lazy:
+            # the record views point into memoryviews of the payloads
+            payloads = {}
+            for chunk in self.rawChunks:
+                for longs in chunk["Heightmaps"].values():
+                    payload = longs.base.obj
+                    payloads[id(payload)] = len(payload)
+            raw = sum(payloads.values())
+        footprint = {
+            "sections": len(sections),
+            "uniformSections": sum(section.states is None
+                                   for section in sections),
+            "airSectionsOmitted": self.sectionsOmitted,
+            "states": states,
+            "mappedStates": mapped,
+            "palettes": palettes,
+            "heightmaps": sum(heightmap.nbytes
+                              for heightmap in heightmaps.values()),
+            "volume": 0 if self.volume is None else self.volume.nbytes,
+            "raw": raw}
+        footprint["total"] = footprint["states"] + footprint["palettes"] \
+            + footprint["heightmaps"] + footprint["volume"] + raw
+        return footprint
+
+    def buildVolume(self):
+        """**Build a dense volume of the rect with a global palette.**
+
+        Returns a uint16 array of palette indices indexed [x, y, z]
+            relative to the rect and world height 0, and the palette of
+            block names shared by all sections. Missing sections are air,
+            which is always index 0.
+        The result is kept as `volume` and `palette`.
+        """
+        self.volume = np.zeros((self.rect[2], 256, self.rect[3]),
+                               dtype=np.uint16)
+        # keep the indices already handed out by getBlocksAt
+        self.initPalette()
         for x in range(self.chunkRect[2]):
             for z in range(self.chunkRect[3]):
-                chunkID = x + z * self.chunkRect[2]
-                chunkSections = self.nbtfile['Chunks'][chunkID]['Level']['Sections']
-
-                for section in chunkSections:
-                    y = section['Y'].value
-
-                    if not ('BlockStates' in section) or len(section['BlockStates']) == 0:
-                        continue
-
-                    palette = section['Palette']
-                    rawBlockStates = section['BlockStates']
-                    bitsPerEntry = max(4, ceil(log2(len(palette))))
-                    blockStatesBitArray = BitArray(
-                        bitsPerEntry, 16 * 16 * 16, rawBlockStates)
-
-                    self.sections[x][z][y] = CachedSection(
-                        palette, blockStatesBitArray)
-
-        print("done")
+                self.fillVolume(x, z)
+        return self.volume, self.palette
+
+    def chunkOverlap(self, x, z):
+        """**Return the part of a chunk inside rect in global coordinates.**
+
+        The chunk is counted from the corner of the chunk rect, the
+            result is (bx, bz, ex, ez) with exclusive ends.
+        """
+        rect = self.rect
+        bx = max(rect[0], (self.chunkRect[0] + x) * 16)
+        bz = max(rect[1], (self.chunkRect[1] + z) * 16)
+        ex = min(rect[0] + rect[2], (self.chunkRect[0] + x + 1) * 16)
+        ez = min(rect[1] + rect[3], (self.chunkRect[1] + z + 1) * 16)
+        return bx, bz, ex, ez
+
+    def paletteLookup(self, section):
+        """**Return the indices of a section's palette in `palette`.**
+
+        Names missing from the slice palette are added to it.
+        """
+        palette = self.palette
+        indices = self.paletteIndices
+        lookup = []
+        for name in section.names:
+            if name not in indices:
+                indices[name] = len(palette)
+                palette.append(name)
+            lookup.append(indices[name])
+        return np.array(lookup, dtype=np.uint16)
+
+    def fillVolume(self, x, z):
+        """**Write the blocks of a chunk into the volume.**"""
+        rect = self.rect
+        bx, bz, ex, ez = self.chunkOverlap(x, z)
+        columns = self.volume[bx - rect[0]:ex - rect[0], :,
+                              bz - rect[1]:ez - rect[1]]
+        columns[:] = 0
+        for y in range(16):
+            section = self.getSection(x, z, y)
+            if section is None:
+                continue
+            lookup = self.paletteLookup(section)
+            if section.states is None:
+                columns[:, y * 16:(y + 1) * 16] = lookup[0]
+                continue
+            # section data is in y, z, x order
+            states = section.states.reshape(
+                16, 16, 16)[:, bz % 16:(ez - 1) % 16 + 1,
+                            bx % 16:(ex - 1) % 16 + 1]
+            columns[:, y * 16:(y + 1) * 16] = \
+                lookup[states].transpose(2, 0, 1)
+
+    def refresh(self, interface=None, chunks=None):
+        """**Fetch the chunks changed through an Interface again.**
+
+        Only the chunks of this slice in `interface.dirty` (by default of
+            the interface the slice was loaded with), or in `chunks` given
+            as global chunk coordinates, are requested and decoded.
+            They are removed from `interface.dirty`, and a BlockCache of
+            the interface over this slice reads them from it again.
+        Heightmaps and the volume are updated in place.
+        Returns the number of refreshed chunks.
+        """
+        if interface is None:
+            interface = self.interface
+        if interface is not None:
+            # send buffered and queued blocks first, so their chunks are
+            #   dirty and part of the new chunks
+            interface.sendPending()
+        x0, z0, dx, dz = self.chunkRect
+        if chunks is None:
+            chunks = () if interface is None else interface.dirty
+        chunks = sorted((cx, cz) for cx, cz in chunks
+                        if x0 <= cx < x0 + dx and z0 <= cz < z0 + dz)
+        if interface is not None:
+            interface.dirty.difference_update(chunks)
+            if interface.cache is not None \
+                    and interface.cache.worldSlice is self:
+                interface.cache.reloaded(chunks)
+        print("refreshing {} chunks".format(len(chunks)))
+        if not chunks:
+            return 0
+
+        for (cx, cz), chunk, compound in self.fetchChunks(chunks, interface):
+            self.replaceChunk(cx - x0, cz - z0, chunk, compound)
+        return len(chunks)
+
+    def fetchChunks(self, chunks, interface=None):
+        """**Yield the chunks at global chunk coordinates from the server.**
+
+        Chunks come as records, or decoded (heightmaps, sections)
+            if the slice uses a ChunkCache. Close chunks share a request.
+        Each is yielded with its position and its NBT compound, which is
+            None unless the slice keeps `nbtfile`.
+        """
+        xs = [cx for cx, cz in chunks]
+        zs = [cz for cx, cz in chunks]
+        rect = (min(xs), min(zs), max(xs) - min(xs) + 1, max(zs) - min(zs) + 1)
+        rects = [rect] if rect[2] * rect[3] <= 2 * len(chunks) \
+            else [(cx, cz, 1, 1) for cx, cz in chunks]
+        for x, z, dx, dz in rects:
+            if self.cache:
+                loaded = self.cache.load((x, z, dx, dz), self.heightmapTypes,
+                                         interface)
+            elif self.nbtfile is not None:
+                loaded, rectFile = readChunkRecords(x, z, dx, dz, interface,
+                                                    keepNbt=True)
+                compounds = rectFile['Chunks']
+            else:
+                loaded = readChunkRecords(x, z, dx, dz, interface)
+            for index, chunk in enumerate(loaded):
+                position = (x + index % dx, z + index // dx)
+                if position in chunks:
+                    yield position, chunk, \
+                        None if self.nbtfile is None else compounds[index]
+
+    def replaceChunk(self, x, z, chunk, compound=None):
+        """**Replace a chunk, counted from the chunk rect, in place.**"""
+        chunkID = x + z * self.chunkRect[2]
+        self.sections[x][z] = [None for i in range(16)]
+        if compound is not None and self.nbtfile is not None:
+            self.nbtfile['Chunks'][chunkID] = compound
+        if self.lazy:
+            self.rawChunks[chunkID] = chunk
+            self.rawSections.pop((x, z), None)
+            heightmaps = {hmName: decodeHeightmap(chunk, hmName)
+                          for hmName in self.heightmaps.decoded}
+            targets = self.heightmaps.decoded
+        else:
+            if self.cache:
+                heightmaps, sections = chunk
+            else:
+                heightmaps, sections = decodeChunk(chunk,
+                                                   self.heightmapTypes)
+            for y, palette, blockStatesBitArray in sections:
+                self.sections[x][z][y] = self.compactSection(
+                    palette, blockStatesBitArray)
+            targets = self.heightmaps
+
+        bx, bz, ex, ez = self.chunkOverlap(x, z)
+        cx = (self.chunkRect[0] + x) * 16
+        cz = (self.chunkRect[1] + z) * 16
+        for hmName, heightmap in targets.items():
+            heightmap[bx - self.rect[0]:ex - self.rect[0],
+                      bz - self.rect[1]:ez - self.rect[1]] = \
+                heightmaps[hmName][bx - cx:ex - cx, bz - cz:ez - cz]
+        if self.volume is not None:
+            self.fillVolume(x, z)
 
     def getBlockCompoundAt(self, blockPos):
-        """**Returns block data.**"""
+        """**Returns block data.**
+
+        This is a dict with the "Name" and "Properties" of the block.
+        """
         # chunkID = relativeChunkPos[0] + relativeChunkPos[1] * self.chunkRect[2]
 
         # section = self.nbtfile['Chunks'][chunkID]['Level']['Sections'][(blockPos[1] >> 4)+1]
@@ -135,22 +686,281 @@ class WorldSlice:
         chunkZ = (blockPos[2] >> 4) - self.chunkRect[1]
         chunkY = blockPos[1] >> 4
         # bitarray = BitArray(bitsPerEntry, 16*16*16, blockStates) # TODO this needs to be 'cached' somewhere
-        cachedSection = self.sections[chunkX][chunkZ][chunkY]
+        cachedSection = self.getSection(chunkX, chunkZ, chunkY)
 
         if cachedSection == None:
             return None  # TODO return air compound instead
 
-        bitarray = cachedSection.blockStatesBitArray
-        palette = cachedSection.palette
-
         blockIndex = (blockPos[1] % 16) * 16 * 16 + \
             (blockPos[2] % 16) * 16 + blockPos[0] % 16
-        return palette[bitarray.getAt(blockIndex)]
+        return cachedSection.getAt(blockIndex)
 
     def getBlockAt(self, blockPos):
         """**Returns the block's namespaced id at blockPos.**"""
         blockCompound = self.getBlockCompoundAt(blockPos)
         if blockCompound == None:
             return "minecraft:air"
+        return blockCompound["Name"]
+
+    def getBlocksAt(self, xs, ys, zs, names=False):
+        """**Return the blocks at many global coordinates at once.**
+
+        The coordinates are arrays (or scalars) broadcast against each
+            other. Returns an array of indices into the block names of
+            `palette` and that list; with `names` an array of the names.
+        Blocks outside the loaded chunks or world height are air.
+        """
+        xs, ys, zs = np.broadcast_arrays(*(np.asarray(coordinates,
+                                                      dtype=np.int64)
+                                           for coordinates in (xs, ys, zs)))
+        ids = np.zeros(xs.shape, dtype=np.uint16)
+        self.initPalette()
+        inVolume = np.zeros(xs.shape, dtype=bool)
+        if self.volume is not None:
+            rect = self.rect
+            inVolume = (xs >= rect[0]) & (xs < rect[0] + rect[2]) \
+                & (zs >= rect[1]) & (zs < rect[1] + rect[3]) \
+                & (ys >= 0) & (ys < 256)
+            ids[inVolume] = self.volume[xs[inVolume] - rect[0], ys[inVolume],
+                                        zs[inVolume] - rect[1]]
+            if inVolume.all():
+                return self.blockResult(ids, names)
+
+        # the rest of the loaded chunks is read from their sections
+        x0, z0, dx, dz = self.chunkRect
+        xs, ys, zs = xs.ravel(), ys.ravel(), zs.ravel()
+        cxs = (xs >> 4) - x0
+        czs = (zs >> 4) - z0
+        inside = (cxs >= 0) & (cxs < dx) & (czs >= 0) & (czs < dz) \
+            & (ys >= 0) & (ys < 256) & ~inVolume.ravel()
+        positions = np.flatnonzero(inside)
+        # group the coordinates by section
+        keys = (cxs[positions] * dz + czs[positions]) * 16 \
+            + (ys[positions] >> 4)
+        order = np.argsort(keys, kind="stable")
+        positions, keys = positions[order], keys[order]
+        starts = np.flatnonzero(np.diff(keys, prepend=-1))
+        ends = np.append(starts[1:], len(keys))
+        # section data is in y, z, x order
+        indices = ((ys & 15) * 16 + (zs & 15)) * 16 + (xs & 15)
+        flat = ids.reshape(-1)
+        lookups = {}
+        for start, end in zip(starts, ends):
+            key = int(keys[start])
+            section = self.getSection(key // 16 // dz, key // 16 % dz,
+                                      key % 16)
+            if section is None:
+                continue
+            lookup = lookups.get(id(section.palette))
+            if lookup is None:
+                lookup = lookups[id(section.palette)] = \
+                    self.paletteLookup(section)
+            selected = positions[start:end]
+            if section.states is None:
+                flat[selected] = lookup[0]
+            else:
+                flat[selected] = lookup[section.states[indices[selected]]]
+        return self.blockResult(ids, names)
+
+    def initPalette(self):
+        """**Start the palette shared with the volume if there is none.**"""
+        if self.palette is None:
+            self.palette = ["minecraft:air"]
+            self.paletteIndices = {"minecraft:air": 0}
+
+    def classTable(self, className):
+        """**Return a boolean table of a block class over `palette`.**
+
+        The classes are those of blockClasses.CLASSES, evaluated once per
+            palette entry, so `classTable("log")[ids]` classifies the
+            indices returned by getBlocksAt or stored in the volume.
+        """
+        self.initPalette()
+        if self.predicates is None or self.predicates.palette is not \
+                self.palette:
+            self.predicates = PredicateIndex(self.palette)
+        return self.predicates.table(className)
+
+    def mask(self, className):
+        """**Return a boolean [x, y, z] mask of a block class over rect.**
+
+        This builds the volume if the slice has none.
+        """
+        if self.volume is None:
+            self.buildVolume()
+        return self.classTable(className)[self.volume]
+
+    def find(self, className):
+        """**Return the global coordinates of all blocks of a class.**
+
+        The result is an (n, 3) array of x, y, z rows, sorted by x,
+            then y, then z.
+        """
+        xs, ys, zs = np.nonzero(self.mask(className))
+        return np.stack((xs + self.rect[0], ys, zs + self.rect[1]), axis=1)
+
+    def blockResult(self, ids, names):
+        """**Return the result of getBlocksAt.**"""
+        if names:
+            return np.array(self.palette)[ids]
+        return ids, self.palette
+
+
+class WorldTiles:
+    """**Walks a large area tile by tile with a bounded memory use.**
+
+    The area is split into tiles of tilesize x tilesize chunks, ordered
+        x first, then z. Each tile is loaded as a WorldSlice of its part
+        of rect grown by `overlap` blocks on every side (within rect).
+    At most `resident` tiles are kept, including the one being
+        prefetched; the least recently used is dropped first. Slices
+        kept elsewhere are not counted.
+    Iterating yields (core, worldSlice) for every tile, where core is
+        the part of rect the tile covers without its overlap. With
+        `prefetch` the next tile is loaded in the background meanwhile.
+    Other keyword arguments are passed to WorldSlice.
+    """
+
+    def __init__(self, rect, tilesize=16, overlap=0, resident=2,
+                 prefetch=True, **options):
+        if resident < (2 if prefetch else 1):
+            raise ValueError("resident must leave room for the prefetch")
+        self.rect = rect
+        self.chunkRect = chunkRectOf(rect)
+        self.tilesize = tilesize
+        self.overlap = overlap
+        self.resident = resident
+        self.options = options
+        self.columns = ceil(self.chunkRect[2] / tilesize)
+        self.cores = []
+        for tx, tz, tdx, tdz in chunkTiles(*self.chunkRect, tilesize):
+            bx, bz = max(rect[0], tx * 16), max(rect[1], tz * 16)
+            ex = min(rect[0] + rect[2], (tx + tdx) * 16)
+            ez = min(rect[1] + rect[3], (tz + tdz) * 16)
+            self.cores.append((bx, bz, ex - bx, ez - bz))
+        self.loaded = OrderedDict()  # worldSlices by tile index
+        self.pending = {}  # futures of prefetched tiles by tile index
+        self.executor = ThreadPoolExecutor(max_workers=1) if prefetch \
+            else None
+        self.loads = 0
+
+    def __len__(self):
+        return len(self.cores)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """**Stop prefetching and drop all tiles.**"""
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+        self.pending = {}
+        self.loaded = OrderedDict()
+
+    def sliceRect(self, index):
+        """**Return the rect of a tile's WorldSlice, with its overlap.**"""
+        rect, overlap = self.rect, self.overlap
+        x, z, dx, dz = self.cores[index]
+        bx, bz = max(rect[0], x - overlap), max(rect[1], z - overlap)
+        ex = min(rect[0] + rect[2], x + dx + overlap)
+        ez = min(rect[1] + rect[3], z + dz + overlap)
+        return bx, bz, ex - bx, ez - bz
+
+    def loadTile(self, index):
+        """**Load the WorldSlice of a tile.**"""
+        self.loads += 1
+        return WorldSlice(self.sliceRect(index), **self.options)
+
+    def makeRoom(self, count, keep=None):
+        """**Drop the least recently used tiles until count more fit.**"""
+        while self.loaded and len(self.loaded) + len(self.pending) + count \
+                > self.resident:
+            index = next(iter(self.loaded))
+            if index == keep:
+                self.loaded.move_to_end(index)
+                if len(self.loaded) == 1:
+                    return
+                continue
+            del self.loaded[index]
+
+    def getTile(self, index):
+        """**Return the WorldSlice of a tile, loading it if needed.**"""
+        worldSlice = self.loaded.get(index)
+        if worldSlice is not None:
+            self.loaded.move_to_end(index)
+            return worldSlice
+        future = self.pending.pop(index, None)
+        if future is not None:
+            worldSlice = future.result()
         else:
-            return blockCompound["Name"].value
+            self.makeRoom(1)
+            worldSlice = self.loadTile(index)
+        self.loaded[index] = worldSlice
+        return worldSlice
+
+    def prefetch(self, index, keep=None):
+        """**Start loading a tile in the background.**"""
+        if self.executor is None or index >= len(self.cores) \
+                or index in self.loaded or index in self.pending:
+            return
+        self.makeRoom(1, keep)
+        self.pending[index] = self.executor.submit(self.loadTile, index)
+
+    def __iter__(self):
+        for index, core in enumerate(self.cores):
+            worldSlice = self.getTile(index)
+            self.prefetch(index + 1, keep=index)
+            yield core, worldSlice
+
+    def tileIndexAt(self, xs, zs):
+        """**Return the tile indices of global coordinates.**"""
+        return ((np.asarray(zs) >> 4) - self.chunkRect[1]) // self.tilesize \
+            * self.columns \
+            + ((np.asarray(xs) >> 4) - self.chunkRect[0]) // self.tilesize
+
+    def getBlocksAt(self, xs, ys, zs):
+        """**Return the block names at many global coordinates at once.**
+
+        Like WorldSlice.getBlocksAt with `names`, loading the tiles
+            involved one after another. Blocks outside rect are air.
+        """
+        xs, ys, zs = np.broadcast_arrays(*(np.asarray(coordinates,
+                                                      dtype=np.int64)
+                                           for coordinates in (xs, ys, zs)))
+        rect = self.rect
+        names = np.full(xs.shape, "minecraft:air", dtype=object)
+        inside = (xs >= rect[0]) & (xs < rect[0] + rect[2]) \
+            & (zs >= rect[1]) & (zs < rect[1] + rect[3])
+        tiles = np.where(inside, self.tileIndexAt(xs, zs), -1)
+        # visit loaded tiles first, so they are not dropped before use
+        indices = sorted(set(np.unique(tiles).tolist()) - {-1},
+                         key=lambda index: index not in self.loaded)
+        for index in indices:
+            selected = tiles == index
+            names[selected] = self.getTile(index).getBlocksAt(
+                xs[selected], ys[selected], zs[selected], names=True)
+        return names
+
+    def getBlockAt(self, blockPos):
+        """**Returns the block's namespaced id at blockPos.**"""
+        return self.getBlocksAt(*blockPos).item()
+
+    def find(self, className):
+        """**Return the global coordinates of all blocks of a class.**
+
+        Like WorldSlice.find over the whole rect, tile by tile; only the
+            core of every tile is searched, so no block is found twice.
+            Every tile builds its volume.
+        """
+        found = [np.zeros((0, 3), dtype=np.int64)]
+        for core, worldSlice in self:
+            coordinates = worldSlice.find(className)
+            inside = (coordinates[:, 0] >= core[0]) \
+                & (coordinates[:, 0] < core[0] + core[2]) \
+                & (coordinates[:, 2] >= core[1]) \
+                & (coordinates[:, 2] < core[1] + core[3])
+            found.append(coordinates[inside])
+        return np.concatenate(found)